@@ -1,7 +1,15 @@
+from . import cache
 from . import constants
+from . import corrections
+from . import cube
 from . import data
 from . import datavar
+from . import derived
 from . import generalutils
 from . import importdata
+from . import indicators
+from . import lookup
 from . import plot
+from . import stats
+from . import units
 from . import geodata
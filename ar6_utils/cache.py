@@ -0,0 +1,47 @@
+import hashlib
+import os
+
+import pandas as pd
+
+
+def file_hash(path, blocksize=2**20):
+    """Hash of the contents of a file, read in blocks of `blocksize` bytes"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(files, **kwargs):
+    """
+    Key that changes whenever the content of one of the `files` changes,
+    or whenever one of the keyword arguments changes.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in files:
+        digest.update(file_hash(path).encode())
+    for key, value in sorted(kwargs.items()):
+        digest.update(f"{key}={value!r};".encode())
+    return digest.hexdigest()
+
+
+def cache_path(folder, key, prefix="ar6_utils"):
+    return os.path.join(folder, f"{prefix}_{key}.pkl")
+
+
+def load(folder, key, prefix="ar6_utils"):
+    """Returns the cached object, or None if it is not in the cache"""
+    path = cache_path(folder, key, prefix)
+    if not os.path.exists(path):
+        return None
+    return pd.read_pickle(path)
+
+
+def save(folder, key, obj, prefix="ar6_utils"):
+    os.makedirs(folder, exist_ok=True)
+    path = cache_path(folder, key, prefix)
+    # Write to a temporary file first, such that an interrupted
+    # write never leaves a corrupt cache file behind
+    pd.to_pickle(obj, path + ".tmp")
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,154 @@
+from dataclasses import dataclass, field
+from functools import reduce
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .data import append_data
+from .derived import OPERATIONS
+from .lookup import get_index
+
+ACTIONS = ["drop", "replace", "recompute"]
+
+
+@dataclass
+class Correction:
+    """
+    Correction of the data of variable `variable` of scenario `name`
+    (in all its regions). Possible actions:
+    - "drop":       remove the variable
+    - "replace":    replace the values of the variable by `values`
+                    (one value for all years, or a dict {year: value})
+    - "recompute":  replace the variable by components[0] `op` components[1] `op` ...
+                    Missing components or values are taken as zero.
+    """
+
+    name: str
+    variable: str
+    action: str
+    components: List[str] = field(default_factory=list)
+    op: str = "+"
+    values: Optional[object] = None
+
+    def __post_init__(self):
+        if self.action not in ACTIONS:
+            raise ValueError(f"{self.action} is not a valid action {ACTIONS}")
+
+
+def to_corrections(corrections):
+    """
+    Converts a table of corrections (a dataframe with the fields of
+    `Correction` as columns) to a list of `Correction`s
+    """
+    if isinstance(corrections, pd.DataFrame):
+        records = corrections.rename(columns=str.lower).to_dict("records")
+        return [
+            Correction(**{k: v for k, v in record.items() if not _is_missing(v)})
+            for record in records
+        ]
+    return list(corrections)
+
+
+def _is_missing(value):
+    return np.isscalar(value) and pd.isna(value)
+
+
+def apply_corrections(data, corrections):
+    """
+    Applies all `corrections` (in order). Only the rows of the corrected
+    scenarios are read, and the corrected rows are replaced in one pass.
+    """
+    corrections = to_corrections(corrections)
+    if len(corrections) == 0:
+        return data
+    years = [c for c in data.columns if isinstance(c, (int, np.integer))]
+    positions = get_index(data).rows(name=list({c.name for c in corrections}))
+    subset = data.iloc[positions]
+    values = subset[years].to_numpy(float)
+
+    # Current rows of the corrected scenarios: (Name, Region, Variable) -> positions in subset
+    keys = zip(subset["Name"], subset["Region"], subset["Variable"])
+    current = {}
+    for i, key in enumerate(keys):
+        current.setdefault(key, []).append(i)
+    new_rows = {}
+    removed = set()
+
+    def get_values(key):
+        if key in new_rows:
+            return new_rows[key][1]
+        if key in current:
+            return values[current[key][0]]
+        return None
+
+    def get_ids(key):
+        if key in new_rows:
+            return new_rows[key][0]
+        if key in current:
+            return subset.iloc[current[key][0]]
+        return None
+
+    for correction in corrections:
+        regions = subset.loc[subset["Name"] == correction.name, "Region"].unique()
+        for region in regions:
+            key = (correction.name, region, correction.variable)
+            if correction.action == "drop":
+                new_rows.pop(key, None)
+                removed.add(key)
+                continue
+
+            if correction.action == "replace":
+                ids = get_ids(key)
+                if ids is None:
+                    continue
+                new_values = np.array(get_values(key), dtype=float)
+                if isinstance(correction.values, dict):
+                    for year, value in correction.values.items():
+                        new_values[years.index(year)] = value
+                else:
+                    new_values[:] = correction.values
+
+            else:  # recompute
+                component_keys = [
+                    (correction.name, region, c) for c in correction.components
+                ]
+                ids = get_ids(key)
+                if ids is None:
+                    # Use the first existing component as template for the new row
+                    templates = [get_ids(k) for k in component_keys]
+                    templates = [t for t in templates if t is not None]
+                    if len(templates) == 0:
+                        continue
+                    ids = templates[0]
+                components = [
+                    np.zeros(len(years)) if v is None else np.nan_to_num(v)
+                    for v in map(get_values, component_keys)
+                ]
+                new_values = reduce(OPERATIONS[correction.op], components)
+
+            ids = ids.copy()
+            ids["Variable"] = correction.variable
+            new_rows[key] = (ids, new_values)
+            removed.add(key)
+
+    # Replace all corrected rows at once
+    drop_positions = [
+        positions[i] for key in removed if key in current for i in current[key]
+    ]
+    keep = np.ones(len(data), dtype=bool)
+    keep[drop_positions] = False
+    if len(new_rows) == 0:
+        return data[keep]
+
+    id_columns = [c for c in data.columns if c not in years]
+    new_data = pd.concat(
+        [
+            pd.DataFrame([ids[id_columns] for ids, _ in new_rows.values()]).reset_index(
+                drop=True
+            ),
+            pd.DataFrame([v for _, v in new_rows.values()], columns=years),
+        ],
+        axis=1,
+    )
+    return append_data(data if keep.all() else data[keep], new_data)
@@ -0,0 +1,203 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class DataCube:
+    """
+    Dense storage of a long-format data dataframe: a float array of shape
+    (scenario, region, variable, year), which can be memory-mapped from disk.
+
+    The dictionaries `name_index`, `region_index` and `variable_index` map
+    names to positions on the axes. The integer array `unit_codes` of shape
+    (scenario, region, variable) contains the position of the unit in `units`,
+    or -1 if the scenario does not report that variable for that region.
+
+    Usage:
+        cube = DataCube.from_data(data, folder)  # Once, writes the cube to `folder`
+        cube = DataCube.load(folder)  # Memory-maps the cube
+        datavar = DataVar(cube, scenarios, vetted_scenarios)
+    """
+
+    VALUES_FILENAME = "values.npy"
+    UNIT_CODES_FILENAME = "unit_codes.npy"
+    AXES_FILENAME = "axes.json"
+
+    def __init__(
+        self,
+        values,
+        unit_codes,
+        names,
+        models,
+        scenarios,
+        regions,
+        variables,
+        years,
+        units,
+    ):
+        self.values = values
+        self.unit_codes = unit_codes
+        self.names = list(names)
+        self.models = list(models)
+        self.scenarios = list(scenarios)
+        self.regions = list(regions)
+        self.variables = list(variables)
+        self.years = [int(y) for y in years]
+        self.units = list(units)
+
+        self.name_index = {name: i for i, name in enumerate(self.names)}
+        self.region_index = {region: i for i, region in enumerate(self.regions)}
+        self.variable_index = {variable: i for i, variable in enumerate(self.variables)}
+
+    @property
+    def is_regional(self):
+        return len(self.regions) > 1
+
+    @classmethod
+    def from_data(cls, data, folder=None):
+        """
+        Creates a cube from a long-format data dataframe. If `folder` is given,
+        the cube is written to that folder and memory-mapped.
+        """
+        years = [c for c in data.columns if isinstance(c, (int, np.integer))]
+        name_codes, names = pd.factorize(data["Name"])
+        region_codes, regions = pd.factorize(data["Region"])
+        variable_codes, variables = pd.factorize(data["Variable"])
+        unit_codes_long, units = pd.factorize(data["Unit"])
+
+        shape = (len(names), len(regions), len(variables))
+        flat_codes = np.ravel_multi_index(
+            (name_codes, region_codes, variable_codes), shape
+        )
+        if len(np.unique(flat_codes)) != len(flat_codes):
+            raise ValueError(
+                "Data contains duplicate (Name, Region, Variable) combinations"
+            )
+
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            values = np.lib.format.open_memmap(
+                os.path.join(folder, cls.VALUES_FILENAME),
+                mode="w+",
+                dtype=float,
+                shape=shape + (len(years),),
+            )
+            values[:] = np.nan
+        else:
+            values = np.full(shape + (len(years),), np.nan)
+        values.reshape(-1, len(years))[flat_codes] = data[years].to_numpy(float)
+
+        unit_codes = np.full(shape, -1, dtype=np.int32)
+        unit_codes.reshape(-1)[flat_codes] = unit_codes_long
+
+        first = data.drop_duplicates("Name").set_index("Name").loc[names]
+        cube = cls(
+            values,
+            unit_codes,
+            names,
+            first["Model"],
+            first["Scenario"],
+            regions,
+            variables,
+            years,
+            units,
+        )
+        if folder is not None:
+            cube.save(folder)
+        return cube
+
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        values_path = os.path.join(folder, self.VALUES_FILENAME)
+        if isinstance(
+            self.values, np.memmap
+        ) and self.values.filename == os.path.abspath(values_path):
+            self.values.flush()
+        else:
+            np.save(values_path, self.values)
+        np.save(os.path.join(folder, self.UNIT_CODES_FILENAME), self.unit_codes)
+        axes = {
+            "names": self.names,
+            "models": self.models,
+            "scenarios": self.scenarios,
+            "regions": self.regions,
+            "variables": self.variables,
+            "years": self.years,
+            "units": self.units,
+        }
+        with open(os.path.join(folder, self.AXES_FILENAME), "w") as file:
+            json.dump(axes, file)
+
+    @classmethod
+    def load(cls, folder, mmap_mode="r"):
+        values = np.load(os.path.join(folder, cls.VALUES_FILENAME), mmap_mode=mmap_mode)
+        unit_codes = np.load(os.path.join(folder, cls.UNIT_CODES_FILENAME))
+        with open(os.path.join(folder, cls.AXES_FILENAME)) as file:
+            axes = json.load(file)
+        return cls(values, unit_codes, **axes)
+
+    def get(self, variable, region=None):
+        """
+        Zero-copy view on the values of one variable. Has shape (scenario, year)
+        if `region` is given or if the cube only contains one region,
+        otherwise (scenario, region, year).
+        """
+        i = self.variable_index[variable]
+        if region is not None:
+            return self.values[:, self.region_index[region], i, :]
+        if not self.is_regional:
+            return self.values[:, 0, i, :]
+        return self.values[:, :, i, :]
+
+    def select(self, variables, regions=None):
+        """
+        Returns the rows of `variables` (and `regions`) as long-format
+        dataframe, in the same format as the data dataframe
+        """
+        variable_i = [
+            self.variable_index[v] for v in variables if v in self.variable_index
+        ]
+        if regions is None:
+            region_i = list(range(len(self.regions)))
+        else:
+            region_i = [self.region_index[r] for r in regions if r in self.region_index]
+
+        unit_codes = self.unit_codes[:, region_i][:, :, variable_i]
+        s, r, v = np.nonzero(unit_codes >= 0)
+        region_i = np.array(region_i, dtype=int)
+        variable_i = np.array(variable_i, dtype=int)
+        values = self.values[s, region_i[r], variable_i[v], :]
+
+        selection = pd.DataFrame(
+            {
+                "Name": np.array(self.names, dtype=object)[s],
+                "Model": np.array(self.models, dtype=object)[s],
+                "Scenario": np.array(self.scenarios, dtype=object)[s],
+                "Region": np.array(self.regions, dtype=object)[region_i[r]],
+                "Variable": np.array(self.variables, dtype=object)[variable_i[v]],
+                "Unit": np.array(self.units, dtype=object)[unit_codes[s, r, v]],
+            }
+        )
+        return pd.concat([selection, pd.DataFrame(values, columns=self.years)], axis=1)
+
+    def to_data(self):
+        """Converts the cube back to a long-format data dataframe"""
+        return self.select(self.variables)
+
+    def create_scenarios(self):
+        return pd.DataFrame(
+            {"Model": self.models, "Scenario": self.scenarios},
+            index=pd.Index(self.names, name="Name"),
+        )
+
+    def unit_map(self):
+        """Most common unit of each variable"""
+        units = {}
+        for i, variable in enumerate(self.variables):
+            codes = self.unit_codes[:, :, i]
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.units))
+            if counts.sum() > 0:
+                units[variable] = self.units[int(np.argmax(counts))]
+        return units
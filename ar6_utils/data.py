@@ -1,55 +1,276 @@
 import operator
 import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 
 from .constants import NO_NET_ZERO, YEARS
+from .indicators import Indicator, add_indicators
+from .lookup import get_index, register_index, select_rows
+
+ID_COLUMNS = ["Name", "Model", "Scenario", "Region", "Variable", "Unit"]
+
+
+def prepare_data(
+    database,
+    startyear=2010,
+    endyear=2100,
+    dt=5,
+    onlyworld=True,
+    regions=None,
+    variables=None,
+    chunksize=None,
+    edge="nearest",
+    edge_limit=5,
+):
+    """
+    Reads an IAMC-format data file. Only the rows of `regions` (default: World
+    if `onlyworld`, otherwise all) and `variables` (default: all) are kept.
+    The identifier columns (see `ID_COLUMNS`) are categorical.
+
+    If `chunksize` is given, CSV files are streamed in chunks of `chunksize`
+    rows and filtered per chunk, such that the full raw file is never in memory.
+
+    Missing mid-decade values are interpolated (see `interpolate_missing_5years`,
+    `edge` and `edge_limit` set the policy for values before the first or after
+    the last reported value).
+    """
+    # Choose only decadal data
+    columns = ["Model", "Scenario", "Region", "Variable", "Unit"] + [
+        str(y) for y in np.arange(startyear, endyear + 1, dt)
+    ]
+    if regions is None and onlyworld:
+        regions = ["World"]
 
-
-def prepare_data(database, startyear=2010, endyear=2100, dt=5, onlyworld=True):
     if ".xls" in database:
         data_raw = pd.read_excel(database)
+        data_raw.columns = [str(c).capitalize() for c in data_raw.columns]
+        data = _filter_rows(data_raw.loc[:, columns], regions, variables)
+        data = to_categorical(data)
     else:
-        data_raw = pd.read_csv(database)
-    data_raw.columns = [str(c).capitalize() for c in data_raw.columns]
-
-    # Choose only decadal data
-    data = data_raw.loc[
-        :,
-        ["Model", "Scenario", "Region", "Variable", "Unit"]
-        + [str(y) for y in np.arange(startyear, endyear + 1, dt)],
-    ]
-
-    # Choose only region == World
-    if onlyworld:
-        data = data[data["Region"] == "World"]
+        header = pd.read_csv(database, nrows=0).columns
+        usecols = [c for c in header if str(c).capitalize() in columns]
+        reader = pd.read_csv(
+            database,
+            usecols=usecols,
+            dtype={c: "category" for c in usecols if str(c).capitalize() in ID_COLUMNS},
+            chunksize=chunksize,
+        )
+        chunks = [reader] if chunksize is None else reader
+        data = concat_data(
+            [_filter_rows(chunk, regions, variables) for chunk in chunks],
+            ignore_index=True,
+        ).loc[:, columns]
+        data = to_categorical(data)
 
     # Add column Name, equal to Model + Scenario
-    data.insert(2, "Name", data["Model"] + " " + data["Scenario"])
+    data.insert(2, "Name", _create_name_column(data["Model"], data["Scenario"]))
 
     # Interpolating missing 5 years columns
-    interpolate_missing_5years(data, startyear=startyear + 5, endyear=endyear + 5)
+    interpolate_missing_5years(
+        data,
+        startyear=startyear + 5,
+        endyear=endyear + 5,
+        edge=edge,
+        edge_limit=edge_limit,
+    )
 
     years = [str(y) for y in np.arange(startyear, endyear + 1, 5)]
-    return data[
-        ["Name", "Model", "Scenario", "Region", "Variable", "Unit"] + years
-    ].rename(columns={y: int(y) for y in years})
+    data = data[ID_COLUMNS + years].rename(columns={y: int(y) for y in years})
+
+    # Build the lookup index of the variables (see `lookup.DataIndex`)
+    get_index(data)
+    return data
 
 
-def interpolate_missing_5years(data, startyear, endyear):
-    for year in range(startyear, endyear, 10):
+def _filter_rows(data, regions=None, variables=None):
+    data.columns = [str(c).capitalize() for c in data.columns]
+    if regions is not None:
+        data = data[data["Region"].isin(regions)]
+    if variables is not None:
+        data = data[data["Variable"].isin(variables)]
+    return data
+
+
+def _create_name_column(model, scenario):
+    # Only concatenate the strings of each unique (model, scenario) combination,
+    # not of each row
+    model, scenario = model.astype("category"), scenario.astype("category")
+    n_scenarios = len(scenario.cat.categories)
+    pair_codes, pairs = pd.factorize(
+        model.cat.codes.to_numpy(np.int64) * n_scenarios + scenario.cat.codes
+    )
+    pair_names = (
+        model.cat.categories.astype(str)[pairs // n_scenarios]
+        + " "
+        + scenario.cat.categories.astype(str)[pairs % n_scenarios]
+    )
+    name_codes, names = pd.factorize(pair_names)
+    return pd.Categorical.from_codes(name_codes[pair_codes], categories=names)
+
+
+def to_categorical(data, columns=None):
+    """
+    Converts the identifier columns of `data` to categorical columns,
+    without unused categories
+    """
+    if columns is None:
+        columns = ID_COLUMNS
+    data = data.copy()
+    for column in columns:
+        if column in data.columns:
+            data[column] = (
+                data[column].astype("category").cat.remove_unused_categories()
+            )
+    return data
+
+
+def concat_data(frames, **kwargs):
+    """
+    Concatenates data dataframes, keeping the identifier columns categorical
+    (`pd.concat` changes categorical columns with different categories to object)
+    """
+    frames = list(frames)
+    for column in ID_COLUMNS:
+        if not all(column in df.columns for df in frames):
+            continue
+        categories = union_categoricals(
+            [df[column].astype("category") for df in frames], sort_categories=False
+        ).categories
+        dtype = pd.CategoricalDtype(categories)
+        frames = [df.astype({column: dtype}) for df in frames]
+    return pd.concat(frames, **kwargs)
+
+
+def append_data(data, new_rows):
+    """
+    Appends `new_rows` to `data`. The lookup index of `data` is extended
+    and used for the result, instead of being rebuilt.
+    """
+    index = get_index(data)
+    combined = concat_data([data, new_rows])
+    register_index(combined, index.extend(new_rows))
+    return combined
+
+
+def replace_values(column, mapping):
+    """
+    Replaces values in a categorical column using the dict `mapping`.
+    Only the categories are replaced, not every row. Categories that
+    become equal are merged.
+    """
+    column = column.astype("category")
+    new_labels = pd.Index([mapping.get(c, c) for c in column.cat.categories])
+    new_codes, new_categories = pd.factorize(new_labels)
+    codes = column.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, new_codes[codes], -1)
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=new_categories),
+        index=column.index,
+        name=column.name,
+    )
+
+
+def interpolate_missing_5years(
+    data, startyear, endyear, edge="nearest", edge_limit=5, all_years=False
+):
+    """
+    Fills the missing values of the mid-decade columns `startyear`, `startyear + 10`, ...
+    (up to `endyear`) by linear interpolation, in one pass over all year columns.
+    If `all_years` is True, missing values in the other 5-year columns are filled too.
+    See `fill_gaps` for the `edge` policy. By default, a missing mid-decade value
+    next to the last (or first) reported value takes over that value.
+    """
+    midyears = list(range(startyear, endyear, 10))
+    for year in midyears:
         if str(year) not in data.columns:
             data[str(year)] = np.nan
-        data.loc[data[str(year)].isna(), str(year)] = data.loc[
-            data[str(year)].isna(), [str(year - 5), str(year + 5)]
-        ].mean(axis=1)
+    years = list(range(startyear - 5, endyear, 5))
+    columns = [str(y) for y in years]
+
+    values = data[columns].to_numpy(float)
+    filled = fill_gaps(values, years, edge=edge, edge_limit=edge_limit)
+    if not all_years:
+        is_midyear = np.isin(years, midyears)
+        filled[:, ~is_midyear] = values[:, ~is_midyear]
+    data[columns] = filled
+
+
+def fill_gaps(values, years, edge=None, edge_limit=None):
+    """
+    Fills the NaN values in each row of the 2D array `values` by linear
+    interpolation between the nearest non-NaN values before and after,
+    with `years` as x-values.
+
+    `edge` sets the policy for NaN values before the first or after the
+    last non-NaN value of a row:
+    - None: leave them NaN
+    - "nearest": use the first or last non-NaN value of the row, for
+      the years at most `edge_limit` years away from it (default: all)
+    """
+    if edge not in [None, "nearest"]:
+        raise ValueError(f"Unknown edge policy {edge}")
+    values = np.asarray(values, dtype=float)
+    years = np.asarray(years, dtype=float)
+    n_rows, n_years = values.shape
+    rows = np.arange(n_rows)[:, None]
+    is_valid = ~np.isnan(values)
+
+    # Column index of the previous and next valid value for each cell
+    positions = np.broadcast_to(np.arange(n_years), values.shape)
+    prev_i = np.maximum.accumulate(np.where(is_valid, positions, -1), axis=1)
+    next_i = np.minimum.accumulate(
+        np.where(is_valid, positions, n_years)[:, ::-1], axis=1
+    )[:, ::-1]
+    has_prev, has_next = prev_i >= 0, next_i < n_years
+    prev_i, next_i = np.clip(prev_i, 0, n_years - 1), np.clip(next_i, 0, n_years - 1)
+
+    v_prev, v_next = values[rows, prev_i], values[rows, next_i]
+    x_prev, x_next = years[prev_i], years[next_i]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = np.where(next_i > prev_i, (years - x_prev) / (x_next - x_prev), 0.0)
+    interpolated = v_prev + (v_next - v_prev) * p
+
+    filled = np.where(has_prev & has_next, interpolated, np.nan)
+    if edge == "nearest":
+        if edge_limit is None:
+            edge_limit = np.inf
+        filled = np.where(
+            has_prev & ~has_next & (years - x_prev <= edge_limit), v_prev, filled
+        )
+        filled = np.where(
+            ~has_prev & has_next & (x_next - years <= edge_limit), v_next, filled
+        )
+    return np.where(is_valid, values, filled)
 
 
 def create_scenarios(data):
-    return data[["Model", "Scenario", "Name"]].groupby("Name").first()
+    scenarios = (
+        data[["Model", "Scenario", "Name"]].groupby("Name", observed=True).first()
+    )
+    scenarios.index = scenarios.index.astype(object)
+    return scenarios.astype(object).sort_index()
+
+
+def scenario_fingerprints(data):
+    """
+    Hash of the rows of each scenario (independent of the order of the rows),
+    indexed by Name. Changes whenever a value or identifier of one of the
+    rows of the scenario changes, or a row is added or removed.
+    """
+    row_hashes = pd.util.hash_pandas_object(
+        data.drop(columns="Name"), index=False
+    ).to_numpy()
+    codes, names = pd.factorize(data["Name"])
+    index = pd.Index(np.asarray(names, dtype=object), name="Name")
+    if len(codes) == 0:
+        return pd.Series([], index=index, dtype=np.uint64)
+    order = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    return pd.Series(np.add.reduceat(row_hashes[order], starts), index=index)
 
 
 def add_variable_year(scenarios, data, name, variable, year=2100):
-    scenarios[name] = data[data["Variable"] == variable].set_index("Name")[year]
+    scenarios[name] = select_rows(data, variable).set_index("Name")[year]
 
 
 def add_variable_range(
@@ -63,12 +284,25 @@ def add_variable_range(
     year_low=2010,
     year_high=2100,
 ):
-    scenarios[name] = (
-        data[data["Variable"] == variable]
-        .set_index("Name")
-        .loc[:, year_low:year_high]
-        .clip(lower=clip_lower, upper=clip_upper)
-        .apply(reduce_fct, axis=1)
+    """
+    `reduce_fct` is the name of one of `indicators.REDUCTIONS`, or a function
+    reducing a row. To compute several indicators, `indicators.add_indicators`
+    is faster.
+    """
+    add_indicators(
+        scenarios,
+        data,
+        [
+            Indicator(
+                name,
+                variable,
+                reduce_fct,
+                year_low,
+                year_high,
+                clip_lower,
+                clip_upper,
+            )
+        ],
     )
 
 
@@ -91,7 +325,7 @@ def create_variable(
         "*": operator.mul,
     }
 
-    td_both = df.loc[df["Variable"].isin([var1, var2])].copy()
+    td_both = to_categorical(select_rows(df, [var1, var2]))
     if overwrite_unit is not None:
         td_both["Unit"] = overwrite_unit
     join_keys = ["Model", "Scenario", "Name", "Region", "Variable", "Unit"]
@@ -110,7 +344,7 @@ def create_variable(
     combined.insert(4, "Variable", new_name)
 
     if append:
-        return pd.concat([df, combined])
+        return append_data(df, combined)
     return combined
 
 
@@ -122,7 +356,7 @@ def add_variables(
     overwrite_unit=None,
     append=True,
 ):
-    td_all = df.loc[df["Variable"].isin(vars)].copy()
+    td_all = to_categorical(select_rows(df, vars))
     if overwrite_unit is not None:
         td_all["Unit"] = overwrite_unit
     join_keys = ["Model", "Scenario", "Name", "Region", "Variable", "Unit"]
@@ -137,48 +371,69 @@ def add_variables(
     combined.insert(4, "Variable", new_name)
 
     if append:
-        return df.append(combined)
+        return append_data(df, combined)
     return combined
 
 
 # Net-zero calculations
-def calc_netzero(scenarios, data, variable, col_name, limit=0):
-    scenarios[col_name] = np.nan
-
-    _selection = data[data["Variable"] == variable]
-
-    # If the 2100 value is larger than the limit, set it to NO_NET_ZERO
-    above_limit = _selection.loc[_selection[2100] > limit, "Name"]
-    scenarios.loc[scenarios.index.isin(above_limit), col_name] = NO_NET_ZERO
-
-    _selection_has_negative_year = (_selection.loc[:, 2020:2100] <= limit).any(axis=1)
-    _selection = _selection[_selection_has_negative_year].set_index("Name")
-    for name, row in _selection.iterrows():
-        if row.loc[2020:2100].isnull().any():
-            continue
-        index = row.loc[2020:2100].index
-        first_negative_i = np.argmin(np.maximum(limit, row.loc[2020:2100].values))
-        if first_negative_i == 0:
-            net_zero = 2020
-        else:
-            year_0 = index[first_negative_i - 1]
-            year_1 = index[first_negative_i]
-            dy = row[year_1] - row[year_0]
-            if dy == 0:
-                if row[year_0] == 0:
-                    net_zero = int(year_0)
-                else:
-                    net_zero = np.nan
-                    print(name)
-            else:
-                net_zero = -row[year_0] * (int(year_1) - int(year_0)) / dy + int(year_0)
-            #                 if net_zero > 2110 or net_zero < 2010:
-            #                     net_zero = np.nan
-
-            if name in scenarios.index:
-                scenarios.loc[name, col_name] = net_zero
-            else:
-                print(name, "not in global scenarios")
+def calc_netzero(
+    scenarios,
+    data,
+    variable,
+    col_name,
+    limit=0,
+    year_low=2020,
+    year_high=2100,
+    region=None,
+):
+    """
+    Adds the column `col_name` with the first year in which `variable` drops
+    to `limit` or below (linearly interpolated between the data years).
+    Scenarios which are above the limit in `year_high` get NO_NET_ZERO,
+    scenarios with missing values in between or without data get NaN.
+    For data with multiple regions, use `region` to select one.
+    """
+    selection = select_rows(data, variable)
+    if region is not None:
+        selection = selection[selection["Region"] == region]
+    names = pd.Index(selection["Name"].astype(object).to_numpy())
+    if names.has_duplicates:
+        raise ValueError(f"Multiple rows per scenario for {variable}, select a region")
+    years = [
+        c
+        for c in selection.columns
+        if isinstance(c, (int, np.integer)) and year_low <= c <= year_high
+    ]
+    values = selection[years].to_numpy(float)
+
+    net_zero = netzero_years(values, np.array(years, dtype=float), limit)
+    # Never reaching the limit (or only in between, with missing values)
+    net_zero[np.isnan(net_zero) & (values[:, -1] > limit)] = NO_NET_ZERO
+
+    net_zero = pd.Series(net_zero, index=names)
+    scenarios[col_name] = net_zero.reindex(scenarios.index)
+
+
+def netzero_years(values, years, limit=0):
+    """
+    Year in which each row of `values` (shape (row, year)) first drops to
+    `limit` or below, linearly interpolated. NaN for rows that never reach
+    the limit or that contain missing values.
+    """
+    below = values <= limit
+    crosses = below.any(axis=1) & ~np.isnan(values).any(axis=1)
+    first = np.argmax(below, axis=1)
+
+    net_zero = np.full(len(values), np.nan)
+    net_zero[crosses & (first == 0)] = years[0]
+    rows = np.flatnonzero(crosses & (first > 0))
+    i = first[rows]
+    value_0, value_1 = values[rows, i - 1], values[rows, i]
+    year_0, year_1 = years[i - 1], years[i]
+    net_zero[rows] = year_0 + (limit - value_0) * (year_1 - year_0) / (
+        value_1 - value_0
+    )
+    return net_zero
 
 
 def get_interp(data, name, variables, year, index_columns=None):
@@ -204,6 +459,48 @@ def get_interp(data, name, variables, year, index_columns=None):
     return interp, year0, year1
 
 
+def interp_years(values, years):
+    """
+    Linearly interpolates the (row, year) dataframe `values` to `years`, all
+    at once. Returns a dataframe with the same index and `years` as columns.
+    Years outside of the range of the columns of `values` get NaN.
+    """
+    grid = np.array(values.columns, dtype=float)
+    x = np.array(years, dtype=float)
+    i1 = np.clip(np.searchsorted(grid, x, side="right"), 1, len(grid) - 1)
+    i0 = i1 - 1
+    p = (x - grid[i0]) / (grid[i1] - grid[i0])
+    array = values.to_numpy(float)
+    result = array[:, i0] * (1 - p) + array[:, i1] * p
+    result[:, (x < grid[0]) | (x > grid[-1])] = np.nan
+    return pd.DataFrame(result, index=values.index, columns=list(years))
+
+
+def interp_row_years(values, years):
+    """
+    Value of each row of the (row, year) dataframe `values` in its own year
+    (`years` has one year per row), linearly interpolated. Rows with a
+    missing year, or a year outside of the range of the columns, get NaN.
+    """
+    grid = np.array(values.columns, dtype=float)
+    years = np.asarray(years, dtype=float)
+    valid = (years >= grid[0]) & (years <= grid[-1])
+    years = np.where(valid, years, grid[0])
+    i1 = np.clip(np.searchsorted(grid, years, side="right"), 1, len(grid) - 1)
+    i0 = i1 - 1
+    p = (years - grid[i0]) / (grid[i1] - grid[i0])
+
+    array = values.to_numpy(float)
+    rows = np.arange(len(array))
+    value_0, value_1 = array[rows, i0], array[rows, i1]
+    # On a grid year, only use the value of that year
+    result = np.where(
+        p == 0, value_0, np.where(p == 1, value_1, value_0 * (1 - p) + value_1 * p)
+    )
+    result[~valid] = np.nan
+    return pd.Series(result, index=values.index)
+
+
 def get_interp_indexed(series, year):
     if isinstance(series, pd.Series):
         index = series.index
@@ -231,7 +528,7 @@ def NBZ_names(vetted_scenarios, categories, is_nbz=True, threshold=50e3):
 
 
 def get_single(data, name, variable):
-    selection = data[(data["Name"] == name) & (data["Variable"] == variable)]
+    selection = select_rows(data, variable, name)
     if len(selection) != 1:
         return None
 
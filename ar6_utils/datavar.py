@@ -1,13 +1,23 @@
+import copy
+import operator
+from collections import OrderedDict
+from functools import partial
+from dataclasses import dataclass
 from typing import Dict
 import numpy as np
 import pandas as pd
 
 from .constants import SSP_SCENARIOS, YEARS, IP_SCENARIOS
-from .data import get_interp, get_interp_indexed
+from .cube import DataCube
+from .data import create_scenarios, interp_row_years, interp_years
+from .importdata import LazyImport
+from .lookup import get_meta_index, select_rows
+from .stats import group_stats
 
 
 class Var:
     index_columns = ["Name"]
+    lazy = False  # If True, arithmetic results in a LazyVar
 
     def __init__(
         self,
@@ -22,8 +32,11 @@ class Var:
         select_unit=None,
         unit="",
         make_positive=False,  # Take absolute value of all values
+        cache=None,  # SelectionCache of the DataVar
+        lazy=False,
     ):
         self.data = data
+        self.lazy = lazy
         self.scenarios = scenarios
         self.vetted_scenarios = vetted_scenarios
         self.unit = unit
@@ -33,7 +46,12 @@ class Var:
         if variable is not None and values is not None:
             raise Exception("variable and values cannot both be defined")
 
-        self._YEARS = list(self.data.filter(regex="\d{4}").columns)
+        if cache is None:
+            self._YEARS = _year_columns(self.data)
+        else:
+            if cache.years is None:
+                cache.years = _year_columns(self.data)
+            self._YEARS = cache.years
 
         if variable is not None:
             self._variable = variable
@@ -50,39 +68,31 @@ class Var:
             # - Strings, corresponding to meta columns containing a year value for each scenario
             years_numbers = [y for y in year if isinstance(y, (int, float))]
             existing_years = list(set(years_numbers).intersection(set(self._YEARS)))
-            interp_years = list(set(years_numbers) - set(self._YEARS))
+            off_grid_years = list(set(years_numbers) - set(self._YEARS))
             years_meta_columns = list(set(year) - set(years_numbers))
 
             # First get years that already exist
-            selection_data = data[data["Variable"].isin(_to_list(variable))]
-            if isinstance(variable, (tuple, list)):
-                # Add "Variable" to the index columns
-                self.index_columns = list(self.index_columns) + ["Variable"]
-
-            if region is not None:
-                selection_data = selection_data[
-                    selection_data["Region"].isin(_to_list(region))
-                ]
-                if not isinstance(region, (tuple, list)):
-                    # Remove "Region" from the index columns
-                    self.index_columns = [
-                        c for c in self.index_columns if c != "Region"
-                    ]
-            if select_unit is not None:
-                selection_data = selection_data[
-                    selection_data["Unit"].isin(_to_list(select_unit))
-                ]
-                if isinstance(select_unit, (tuple, list)):
-                    # Add "Unit" to the index columns
-                    self.index_columns = list(self.index_columns) + ["Unit"]
-
-            selection = selection_data.set_index(self.index_columns)
+            select = partial(self._select_data, variable, region, select_unit)
+            if cache is None:
+                self.index_columns, selection = select()
+            else:
+                key = (
+                    _cache_key(variable),
+                    _cache_key(region),
+                    _cache_key(select_unit),
+                    tuple(self.index_columns),
+                )
+                self.index_columns, selection = cache.get(key, select)
             self._values = selection[existing_years].rename_axis(columns="Year")
             # Then interpolate all other years:
-            for y in interp_years:
-                self._values[y] = get_interp(
-                    selection_data, None, [variable], float(y), self.index_columns
-                )[0].T.iloc[:, 0]
+            if len(off_grid_years) > 0:
+                self._values = pd.concat(
+                    [
+                        self._values,
+                        interp_years(selection[self._YEARS], off_grid_years),
+                    ],
+                    axis=1,
+                ).rename_axis(columns="Year")
 
             # Then interpolate year values from meta columns (e.g. net-zero columns)
             for column in years_meta_columns:
@@ -109,6 +119,44 @@ class Var:
         if make_positive:
             self._values = abs(self._values)
 
+    def _select_data(self, variable, region, select_unit):
+        """
+        Returns the index columns and the rows of `variable` (and `region`
+        and `select_unit`), indexed by the index columns
+        """
+        data = self.data
+        index_columns = self.index_columns
+        if isinstance(data, DataCube):
+            selection_data = data.select(
+                _to_list(variable),
+                None if region is None else _to_list(region),
+            )
+        elif isinstance(data, LazyImport):
+            selection_data = data.select(_to_list(variable))
+        else:
+            selection_data = select_rows(data, _to_list(variable))
+        if isinstance(variable, (tuple, list)):
+            # Add "Variable" to the index columns
+            index_columns = list(index_columns) + ["Variable"]
+
+        if region is not None:
+            selection_data = selection_data[
+                selection_data["Region"].isin(_to_list(region))
+            ]
+            if not isinstance(region, (tuple, list)):
+                # Remove "Region" from the index columns
+                index_columns = [c for c in index_columns if c != "Region"]
+        if select_unit is not None:
+            selection_data = selection_data[
+                selection_data["Unit"].isin(_to_list(select_unit))
+            ]
+            if isinstance(select_unit, (tuple, list)):
+                # Add "Unit" to the index columns
+                index_columns = list(index_columns) + ["Unit"]
+
+        selection = selection_data.set_index(index_columns)
+        return index_columns, selection
+
     def select(
         self,
         meta: Dict = None,
@@ -116,6 +164,8 @@ class Var:
         ip=None,
         ssp=None,
         long_format=True,
+        value_years="all",
+        output=None,
     ):
         """
         Filter the resulting values dataframe
@@ -134,65 +184,153 @@ class Var:
 
             ## Selects all scenarios with CO2 emissions in 2050 between 0 and 20 GtCO2
 
+            With multiple years, the values of all years need to satisfy `value`,
+            or the value of any year if `value_years="any"`.
+
         - ip:       None, "all" or any/subset of [CurPol, ModAct, GS, Neg, Ren, LD, SP]
         - ssp:      None, "all" or any/subset of [SSP1-19, SSP1-26, SSP4-34, SSP2-45, SSP4-60, SSP3-70, SSP5-85]
 
+        (c) Use `output="numpy"` to get the selection as `SelectionArrays` instead of
+        a dataframe (or `output="arrow"` for a pyarrow Table).
+
+        """
+        if output not in [None, "numpy", "arrow"]:
+            raise ValueError(f"{output} is not a valid output [numpy, arrow]")
+
+        selection, extra_columns = self._select_meta(meta)
+
+        # Values of the scenarios that can still be selected
+        # (for a LazyVar, only these scenarios are evaluated)
+        names = selection.index
+        if ssp is not None:
+            names = names.union([v.scenario for v in SSP_SCENARIOS.values()])
+        all_values = self._select_values(names)
+
+        # Value selection
+        if value is not None and value != "all":
+            rows = _value_mask(all_values, _to_list(value), value_years)
+            selection_names = all_values.index.get_level_values("Name")[rows]
+            selection = selection[selection.index.isin(selection_names)]
+
+        selection, extra_columns = self._select_ip_ssp(
+            selection, extra_columns, ip, ssp
+        )
+
+        if output is not None:
+            return self._select_arrays(all_values, selection, extra_columns, output)
+
+        subset_values = all_values[
+            all_values.index.get_level_values("Name").isin(selection.index)
+        ]
+        is_series = isinstance(subset_values, pd.Series)
+        if is_series:
+            subset_values = subset_values.to_frame()
+
+        index_columns = list(subset_values.index.names)
+        # Merge with extra columns
+        subset_values = subset_values.merge(
+            selection[extra_columns], left_index=True, right_index=True, how="left"
+        ).reset_index()
+        if len(extra_columns) > 0:
+            subset_values = subset_values.sort_values(extra_columns)
+        subset_values = _remove_unused_categories(subset_values)
+        subset_values = subset_values.set_index(
+            extra_columns + index_columns
+        ).rename_axis(columns="Year")
+        if is_series:
+            if long_format:
+                return subset_values.reset_index().rename_axis(columns=None)
+
+            # Change back to Series
+            return subset_values.iloc[:, 0]
+
+        if long_format:
+            if str in [type(col) for col in subset_values.columns]:
+                return subset_values.reset_index().rename_axis(columns=None)
+            return subset_values.stack().to_frame("Value").reset_index()
+        return subset_values
+
+    def stats(
+        self, by, quantiles=None, mean=True, count=True, meta=None, ip=None, ssp=None
+    ):
         """
+        Quantiles (default 5%, 50% and 95%), mean and count of the values per
+        group of scenarios and per year. The groups are given by the meta
+        columns (or index levels, e.g. Region) `by`. The scenarios are
+        selected with `meta`, `ip` and `ssp` as in `select()`.
+
+        Returns a dataframe with index (`by`, Year) and a column per quantile,
+        "mean" and "count":
+
+            Example: stats = datavar("Emissions|CO2").stats("Category")
+                     plot.add_funnel(fig, stats.loc["C1"], 0.05, 0.95, 0.5)
+        """
+        by = _to_list(by)
+        meta = dict(meta or {})
+        for column in by:
+            if (column == "IP" and ip is not None) or (
+                column == "SSP" and ssp is not None
+            ):
+                continue
+            if column not in ["Name", "Region", "Variable", "Unit"]:
+                meta.setdefault(column, "all")
+        arrays = self.select(meta, ip=ip, ssp=ssp, output="numpy")
+        groups = {}
+        for column in by:
+            if column == "Name":
+                groups[column] = arrays.names
+            else:
+                groups[column] = arrays.meta.get(column, arrays.index.get(column))
+        return group_stats(
+            pd.DataFrame(arrays.values, columns=arrays.years),
+            pd.DataFrame(groups),
+            quantiles,
+            mean,
+            count,
+        )
 
-        selection = self.vetted_scenarios.copy()
+    def _select_meta(self, meta):
+        """Vetted scenarios that satisfy the `meta` filters, and the filtered columns"""
+        vetted_scenarios = self.vetted_scenarios
+        meta_index = get_meta_index(vetted_scenarios)
+        mask = np.ones(len(vetted_scenarios), dtype=bool)
         extra_columns = []
+        lazy_columns = {}
 
         # Meta
         if meta is None:
             meta = {}
         for column, _value in meta.items():
-            if column == selection.index.name:
+            if column == vetted_scenarios.index.name:
                 values = _to_list(_value)
-                selection = selection[selection.index.isin(values)]
+                mask &= vetted_scenarios.index.isin(values)
 
             else:
+                if column not in vetted_scenarios.columns and isinstance(
+                    self.data, LazyImport
+                ):
+                    # Meta column that is only calculated when used
+                    lazy_columns[column] = self.data.meta_column(column).reindex(
+                        vetted_scenarios.index
+                    )
                 # Check if column exists
-                if column not in selection.columns:
+                if (
+                    column not in vetted_scenarios.columns
+                    and column not in lazy_columns
+                ):
                     raise KeyError(
                         f"{column} is not an existing column in the metadata"
                     )
-
-                if _value != "all":
-                    mask = (selection[column] == True) & False  # Start with empty mask
-                    values = _to_list(_value)
-                    # Check for ranges:
-                    ranges = [v for v in values if isinstance(v, pd.Interval)]
-                    for v in ranges:
-                        mask = mask | selection[column].between(v.left, v.right)
-
-                    # All other values:
-                    mask = mask | selection[column].isin(values)
-                else:
-                    mask = ~selection[column].isna()
-                selection = selection[mask]
+                mask &= meta_index.mask(column, _value, lazy_columns.get(column))
                 extra_columns.append(column)
 
-        # Value selection
-        if value is not None and value != "all":
-            values = _to_list(value)
-            selection_names = set()
-
-            # Check for ranges:
-            ranges = [v for v in values if isinstance(v, pd.Interval)]
-            for v in ranges:
-                _names = self._values[
-                    _all_row(self._values >= v.left) & _all_row(self._values <= v.right)
-                ].index
-                selection_names = selection_names.union(set(_names))
-
-            # All other values:
-            for v in values:
-                if v not in ranges:
-                    _names = self._values[_all_row(self._values == v)].index
-                    selection_names = selection_names.union(set(_names))
-
-            selection = selection[selection.index.isin(selection_names)]
+        selection = vetted_scenarios[mask]
+        if len(lazy_columns) > 0:
+            selection = selection.assign(**lazy_columns)
+        return selection, extra_columns
 
+    def _select_ip_ssp(self, selection, extra_columns, ip, ssp):
+        """Scenarios of `selection` that are one of the IPs `ip` or SSPs `ssp`"""
         # Illustrative Pathways
         if ip is not None:
             if ip == "all":
@@ -223,43 +361,55 @@ class Var:
             selection = selection[
                 selection.index.isin([SSP_SCENARIOS[v].scenario for v in ssp])
             ]
-            for v in ssp:
-                if SSP_SCENARIOS[v].scenario not in selection.index:
-                    # Add unvetted ssp
-                    selection = selection.append(
-                        self.scenarios.loc[SSP_SCENARIOS[v].scenario]
-                    )
+            # Add unvetted ssps
+            unvetted = [
+                SSP_SCENARIOS[v].scenario
+                for v in dict.fromkeys(ssp)
+                if SSP_SCENARIOS[v].scenario not in selection.index
+            ]
+            if len(unvetted) > 0:
+                selection = pd.concat([selection, self.scenarios.loc[unvetted]])
             extra_columns.append("SSP")
-
-        subset_values = self._values[
-            self._values.index.get_level_values("Name").isin(selection.index)
-        ]
-        is_series = isinstance(subset_values, pd.Series)
-        if is_series:
-            subset_values = subset_values.to_frame()
-
-        index_columns = list(subset_values.index.names)
-        # Merge with extra columns
-        subset_values = subset_values.merge(
-            selection[extra_columns], left_index=True, right_index=True, how="left"
-        ).reset_index()
+        return selection, extra_columns
+
+    def _select_arrays(self, values, selection, extra_columns, output):
+        # Rows of the selected scenarios, without merging values and metadata
+        names = values.index.get_level_values("Name")
+        rows = np.flatnonzero(names.isin(selection.index))
+        codes = selection.index.get_indexer(names[rows])
+        meta = {column: selection[column].to_numpy()[codes] for column in extra_columns}
         if len(extra_columns) > 0:
-            subset_values = subset_values.sort_values(extra_columns)
-        subset_values = subset_values.set_index(
-            extra_columns + index_columns
-        ).rename_axis(columns="Year")
-        if is_series:
-            if long_format:
-                return subset_values.reset_index().rename_axis(columns=None)
-
-            # Change back to Series
-            return subset_values.iloc[:, 0]
+            # Sorted by the meta columns, as the dataframe output
+            order = np.lexsort([_sort_codes(meta[c]) for c in reversed(extra_columns)])
+            rows, codes = rows[order], codes[order]
+            meta = {
+                column: column_values[order] for column, column_values in meta.items()
+            }
+
+        if isinstance(values, pd.Series):
+            array, years = values.to_numpy(float)[:, None], [self._year]
+        else:
+            array, years = values.to_numpy(float), list(values.columns)
+        index = {
+            level: values.index.get_level_values(level).to_numpy()[rows]
+            for level in values.index.names
+            if level != "Name"
+        }
+        arrays = SelectionArrays(
+            values=array[rows],
+            years=years,
+            scenarios=selection.index,
+            codes=codes,
+            index=index,
+            meta=meta,
+        )
+        if output == "arrow":
+            return arrays.to_arrow()
+        return arrays
 
-        if long_format:
-            if str in [type(col) for col in subset_values.columns]:
-                return subset_values.reset_index().rename_axis(columns=None)
-            return subset_values.stack().to_frame("Value").reset_index()
-        return subset_values
+    def _select_values(self, names):
+        """Values, of at least the scenarios `names`"""
+        return self._values
 
     def _repr_html_(self):
         n = len(self._values)
@@ -272,79 +422,112 @@ class Var:
             print(self._values.__repr__())
 
     def _check_and_harmonise_inputs(self, other):
-        if isinstance(other, (int, float)):
-            return self._values, other
-        return self._check_and_harmonise_inputs_columns(other)
+        """
+        Aligns the values of self and other for an elementwise operation.
+        Returns the index and columns (None for a single year) of the result,
+        and the values of self and other as arrays that broadcast to it.
+        """
+        self_values, other_values = self._values, other._values
+        columns_self, columns_other = self._check_and_harmonise_inputs_columns(other)
+
+        # The result has the years of the values the other is broadcast to
+        if set(self_values.index.names) < set(other_values.index.names):
+            columns = columns_other
+        else:
+            columns = columns_self
+        if columns is not None and not columns_self.equals(columns_other):
+            columns = columns_self.join(columns_other, how="outer")
+
+        index, self_array, other_array = self._check_and_harmonise_inputs_indices(
+            self_values.index,
+            other_values.index,
+            _to_array(self_values, columns),
+            _to_array(other_values, columns),
+        )
+        return index, columns, self_array, other_array
 
     def _check_and_harmonise_inputs_columns(self, other):
+        # Years (columns) of self and other, after broadcasting a single year
         y1, y2 = self._year, other._year
 
-        self_values = self._values
-        other_values = other._values
-
         # Case 1: both are multiple years
         if isinstance(y1, list) and isinstance(y2, list):
             if set(y1) != set(y2):
                 raise Exception(f"Years of left var ({y1}) not compatible with ({y2})")
+            return self._values.columns, other._values.columns
 
-        # Case 2: self multiple years, other single year
-        elif isinstance(y1, list) and not isinstance(y2, list):
-            # Duplicate values of other to have the same value
-            # at every year of self
-            harmonised_values2 = pd.DataFrame({year: other._values for year in y1})
-            other_values = harmonised_values2
+        # Case 2: self multiple years, other single year: the values of other
+        # are used at every year of self (as column vector)
+        if isinstance(y1, list) and not isinstance(y2, list):
+            return self._values.columns, pd.Index(y1)
 
         # Case 3: inverse of case 2
-        elif not isinstance(y1, list) and isinstance(y2, list):
-            harmonised_values1 = pd.DataFrame({year: self._values for year in y2})
-            self_values = harmonised_values1
-
-        # Case 4: var1 and var2 are single year: do nothing
+        if not isinstance(y1, list) and isinstance(y2, list):
+            return pd.Index(y2), other._values.columns
 
-        return self._check_and_harmonise_inputs_indices(self_values, other_values)
+        # Case 4: var1 and var2 are single year
+        return None, None
 
-    def _check_and_harmonise_inputs_indices(self, self_values, other_values):
-        names_self = set(self_values.index.names)
-        names_other = set(other_values.index.names)
+    def _check_and_harmonise_inputs_indices(
+        self, index_self, index_other, self_array, other_array
+    ):
+        names_self = set(index_self.names)
+        names_other = set(index_other.names)
         # Case 1: names_self and names_other are equal: nothing needs to happen
-        if names_self == names_other:
-            return self_values, other_values
 
-        # Case 2: names_self is a subset of names_other: broadcast of names_self to names_other
-        if names_self.issubset(names_other):
-            self_values = other_values * 0 + self_values
-        # Case 3: names_other is a subset of names_self: broadcast of names_other to names_self
+        # Case 2: names_self is a subset of names_other: broadcast of self to the
+        # index of other. Values of self are missing where other is missing.
+        if names_self == names_other:
+            pass
+        elif names_self.issubset(names_other):
+            index_self, rows_other, rows_self = _join(index_other, index_self)
+            self_array = _mask_missing(
+                _take(self_array, rows_self), _take(other_array, rows_other)
+            )
+        # Case 3: names_other is a subset of names_self: broadcast of other to self
         elif names_other.issubset(names_self):
-            other_values = self_values * 0 + other_values
+            index_other, rows_self, rows_other = _join(index_self, index_other)
+            other_array = _mask_missing(
+                _take(other_array, rows_other), _take(self_array, rows_self)
+            )
         else:
             raise Exception(
                 f"Index levels {names_self} not compatible with {names_other}."
             )
-        return self_values, other_values
 
-    def _interp_value_year_from_meta_column(self, data, column):
-        def _get_value_fct(row):
-            try:
-                year = min(2101, self.scenarios.loc[row.name, column])
-                if year <= 2100:
-                    return get_interp_indexed(row, year)[0]
-                else:
-                    return np.nan
-            except KeyError:
-                return np.nan
-
-        return data.apply(lambda row: _get_value_fct(row), axis=1)
+        # Align the rows of both
+        index, rows_self, rows_other = _join(index_self, index_other)
+        return index, _take(self_array, rows_self), _take(other_array, rows_other)
 
-    def __add__(self, other):
-        self_values, other_values = Var._check_and_harmonise_inputs(self, other)
-        new_values = self_values.add(
-            other_values, fill_value=getattr(other, "default", None)
-        )
-        other_unit = getattr(other, "unit", "[?]")
-        if isinstance(other, (int, float)) or other_unit == self.unit:
-            new_unit = self.unit
+    def _interp_value_year_from_meta_column(self, data, column):
+        # Year of each row of `data`, from the meta column of its scenario
+        if column not in self.scenarios.columns and isinstance(self.data, LazyImport):
+            # Meta column that is only calculated when used
+            meta_years = self.data.meta_column(column)
         else:
-            new_unit = f"({self.unit} + {other_unit})"
+            meta_years = self.scenarios[column]
+        meta_years = meta_years[~meta_years.index.duplicated()]
+        names = data.index.get_level_values("Name")
+        years = pd.to_numeric(meta_years.reindex(names), errors="coerce")
+        return interp_row_years(data, years.to_numpy(float))
+
+    def _binary(self, op, other, new_unit):
+        if self.lazy or getattr(other, "lazy", False):
+            return LazyVar(op, self, other, new_unit)
+        if isinstance(other, (int, float)):
+            new_values = OPERATIONS[op](self._values, other, None)
+        else:
+            index, columns, self_array, other_array = Var._check_and_harmonise_inputs(
+                self, other
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result = ARRAY_OPERATIONS[op](self_array, other_array, other.default)
+            if columns is None:
+                name = self._values.name
+                name = name if name == other._values.name else None
+                new_values = pd.Series(result, index=index, name=name)
+            else:
+                new_values = pd.DataFrame(result, index=index, columns=columns)
         return Var(
             self.data,
             self.scenarios,
@@ -354,14 +537,18 @@ class Var:
             unit=new_unit,
         )
 
+    def __add__(self, other):
+        other_unit = getattr(other, "unit", "[?]")
+        if isinstance(other, (int, float)) or other_unit == self.unit:
+            new_unit = self.unit
+        else:
+            new_unit = f"({self.unit} + {other_unit})"
+        return self._binary("add", other, new_unit)
+
     def __radd__(self, other):
         return self.__add__(other)
 
     def __sub__(self, other):
-        self_values, other_values = Var._check_and_harmonise_inputs(self, other)
-        new_values = self_values.sub(
-            other_values, fill_value=getattr(other, "default", None)
-        )
         other_unit = getattr(other, "unit", "[?]")
         if isinstance(other, (int, float)) or other_unit == self.unit:
             new_unit = self.unit
@@ -371,23 +558,12 @@ class Var:
             new_unit = self.unit
         else:
             new_unit = f"({self.unit} - {other_unit})"
-        return Var(
-            self.data,
-            self.scenarios,
-            self.vetted_scenarios,
-            values=new_values,
-            default=self.default,
-            unit=new_unit,
-        )
+        return self._binary("sub", other, new_unit)
 
     def __neg__(self):
         return self.__rsub__(0)
 
     def __rsub__(self, other):
-        self_values, other_values = Var._check_and_harmonise_inputs(self, other)
-        new_values = self_values.rsub(
-            other_values, fill_value=getattr(other, "default", None)
-        )
         other_unit = getattr(other, "unit", "[?]")
         if isinstance(other, (int, float)) or other_unit == self.unit:
             new_unit = self.unit
@@ -397,58 +573,27 @@ class Var:
             new_unit = self.unit
         else:
             new_unit = f"({other_unit} - {self.unit})"
-        return Var(
-            self.data,
-            self.scenarios,
-            self.vetted_scenarios,
-            values=new_values,
-            default=self.default,
-            unit=new_unit,
-        )
+        return self._binary("rsub", other, new_unit)
 
     def __mul__(self, other):
-        self_values, other_values = Var._check_and_harmonise_inputs(self, other)
-        new_values = self_values.mul(
-            other_values, fill_value=getattr(other, "default", None)
-        )
         other_unit = getattr(other, "unit", "[?]")
         if isinstance(other, (int, float)):
             new_unit = self.unit
         else:
             new_unit = f"({self.unit} * {other_unit})"
-        return Var(
-            self.data,
-            self.scenarios,
-            self.vetted_scenarios,
-            values=new_values,
-            default=self.default,
-            unit=new_unit,
-        )
+        return self._binary("mul", other, new_unit)
 
     __rmul__ = __mul__
 
     def __pow__(self, other):
-        self_values, other_values = Var._check_and_harmonise_inputs(self, other)
-        new_values = self_values**other_values
         other_unit = getattr(other, "unit", "[?]")
         if isinstance(other, (int, float)):
             new_unit = f"({self.unit} ** {other})"
         else:
             new_unit = f"({self.unit} ** {other_unit})"
-        return Var(
-            self.data,
-            self.scenarios,
-            self.vetted_scenarios,
-            values=new_values,
-            default=self.default,
-            unit=new_unit,
-        )
+        return self._binary("pow", other, new_unit)
 
     def __truediv__(self, other):
-        self_values, other_values = Var._check_and_harmonise_inputs(self, other)
-        new_values = self_values.truediv(
-            other_values, fill_value=getattr(other, "default", None)
-        )
         other_unit = getattr(other, "unit", "[?]")
         if isinstance(other, (int, float)):
             new_unit = self.unit
@@ -456,20 +601,9 @@ class Var:
             new_unit = "[dimensionless]"
         else:
             new_unit = f"({self.unit} / {other_unit})"
-        return Var(
-            self.data,
-            self.scenarios,
-            self.vetted_scenarios,
-            values=new_values,
-            default=self.default,
-            unit=new_unit,
-        )
+        return self._binary("truediv", other, new_unit)
 
     def __rtruediv__(self, other):
-        self_values, other_values = Var._check_and_harmonise_inputs(self, other)
-        new_values = self_values.rtruediv(
-            other_values, fill_value=getattr(other, "default", None)
-        )
         other_unit = getattr(other, "unit", "[?]")
         if isinstance(other, (int, float)):
             new_unit = self.unit
@@ -477,14 +611,267 @@ class Var:
             new_unit = "[dimensionless]"
         else:
             new_unit = f"({other_unit}) / ({self.unit})"
-        return Var(
-            self.data,
-            self.scenarios,
-            self.vetted_scenarios,
-            values=new_values,
-            default=self.default,
-            unit=new_unit,
+        return self._binary("rtruediv", other, new_unit)
+
+
+@dataclass
+class SelectionArrays:
+    """
+    Output of `Var.select(output="numpy")`: the values of the selected rows
+    as one (row, year) array, with the scenario and metadata of each row.
+    """
+
+    values: np.ndarray  # (row, year)
+    years: list
+    scenarios: pd.Index  # Selected scenarios (Name)
+    codes: np.ndarray  # Position in `scenarios` of each row
+    index: Dict[str, np.ndarray]  # Other index levels (e.g. Region) of each row
+    meta: Dict[str, np.ndarray]  # Selected meta columns of each row
+
+    @property
+    def names(self):
+        return self.scenarios.to_numpy()[self.codes]
+
+    def to_arrow(self):
+        """
+        pyarrow Table with a column per year, Name as dictionary column and
+        the other index levels and meta columns
+        """
+        try:
+            import pyarrow as pa
+        except ImportError as error:
+            raise ImportError("pyarrow is required for the arrow output") from error
+
+        columns = {
+            "Name": pa.DictionaryArray.from_arrays(
+                pa.array(self.codes, type=pa.int32()),
+                pa.array(self.scenarios.to_numpy(), from_pandas=True),
+            )
+        }
+        for column, column_values in {**self.index, **self.meta}.items():
+            columns[column] = pa.array(column_values, from_pandas=True)
+        values = np.asfortranarray(self.values)
+        for i, year in enumerate(self.years):
+            columns[str(year)] = pa.array(values[:, i])
+        return pa.table(columns)
+
+
+class LazyVar(Var):
+    """
+    Result of arithmetic on the `Var`s of a lazy `DataVar`: an expression
+    tree which is only evaluated when its values are used, and then for
+    `select()` only for the scenarios that can be selected. If all `Var`s in
+    the expression have the same index and years, they are aligned once and
+    the expression is evaluated in one pass over NumPy arrays.
+    """
+
+    lazy = True
+
+    def __init__(self, op, left, right, unit):
+        self.data = left.data
+        self.scenarios = left.scenarios
+        self.vetted_scenarios = left.vetted_scenarios
+        self.index_columns = left.index_columns
+        self.unit = unit
+        self.default = left.default
+        self._op = op
+        self._left = left
+        self._right = right
+
+        years = [v._year for v in (left, right) if isinstance(v, Var)]
+        list_years = [y for y in years if isinstance(y, list)]
+        self._year = list_years[0] if len(list_years) > 0 else years[0]
+        self._evaluated = None
+
+    @property
+    def _values(self):
+        if self._evaluated is None:
+            self._evaluated = self._evaluate()
+        return self._evaluated
+
+    def _select_values(self, names):
+        if self._evaluated is not None:
+            return self._evaluated
+        return self._evaluate(names)
+
+    def _evaluate(self, names=None):
+        leaves = _leaves(self)
+        if _can_fuse(leaves):
+            return _evaluate_fused(self, leaves, names)
+        return _evaluate_eager(self, names)._values
+
+
+def _leaves(node):
+    if isinstance(node, LazyVar):
+        return _leaves(node._left) + _leaves(node._right)
+    if isinstance(node, Var):
+        return [node]
+    return []
+
+
+def _restrict(values, names):
+    if names is None:
+        return values
+    return values[values.index.get_level_values("Name").isin(names)]
+
+
+def _to_array(values, columns):
+    """Values as float array, a single year as column vector if `columns`"""
+    if isinstance(values, pd.Series):
+        array = values.to_numpy(float)
+        return array if columns is None else array[:, None]
+    if values.columns.equals(columns):
+        return values.to_numpy(float)
+    return values.reindex(columns=columns).to_numpy(float)
+
+
+def _join(index1, index2):
+    """Index of the result of aligning `index1` and `index2` (as pandas does),
+    and the positions of both in it (None if unchanged)"""
+    if index1.equals(index2):
+        return index1, None, None
+    return index1.join(index2, how="outer", return_indexers=True)
+
+
+def _take(array, rows):
+    # Rows of `array`, NaN for the positions -1
+    if rows is None:
+        return array
+    if len(array) == 0:
+        return np.full((len(rows),) + array.shape[1:], np.nan)
+    result = array[rows]
+    result[rows == -1] = np.nan
+    return result
+
+
+def _mask_missing(array, target):
+    # Broadcast values are missing where the target is missing
+    missing = np.isnan(target)
+    if not missing.any():
+        return array
+    return np.where(missing, np.nan, array)
+
+
+def _evaluate_eager(node, names):
+    # Evaluates the expression with the Var operators, on restricted copies
+    if isinstance(node, LazyVar):
+        left = _evaluate_eager(node._left, names)
+        right = _evaluate_eager(node._right, names)
+        return left._binary(node._op, right, node.unit)
+    if isinstance(node, Var):
+        leaf = copy.copy(node)
+        leaf.lazy = False
+        leaf._values = _restrict(node._values, names)
+        return leaf
+    return node
+
+
+def _can_fuse(leaves):
+    first = leaves[0]._values
+    for leaf in leaves:
+        values = leaf._values
+        if (
+            type(values) is not type(first)
+            or list(values.index.names) != list(first.index.names)
+            or not values.index.is_unique
+        ):
+            return False
+        if isinstance(values, pd.DataFrame) and list(values.columns) != list(
+            first.columns
+        ):
+            return False
+    return True
+
+
+def _evaluate_fused(node, leaves, names):
+    values = {id(leaf): _restrict(leaf._values, names) for leaf in leaves}
+    index = _union_index(node, values)
+    arrays = {key: v.reindex(index).to_numpy(float) for key, v in values.items()}
+    present = {}
+    for key, v in values.items():
+        present[key] = np.zeros(len(index), dtype=bool)
+        present[key][index.get_indexer(v.index)] = True
+        if arrays[key].ndim == 2:
+            present[key] = present[key][:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result, _ = _evaluate_arrays(node, arrays, present)
+    first = values[id(leaves[0])]
+    if isinstance(first, pd.Series):
+        return pd.Series(result, index=index, name="Value")
+    return pd.DataFrame(result, index=index, columns=first.columns)
+
+
+def _union_index(node, values):
+    # Index of the result, as the pandas operators would align the operands
+    if isinstance(node, LazyVar):
+        left = _union_index(node._left, values)
+        right = _union_index(node._right, values)
+        if right is None or left.equals(right):
+            return left
+        return left.union(right)
+    if isinstance(node, Var):
+        return values[id(node)].index
+    return None
+
+
+def _evaluate_arrays(node, arrays, present):
+    """
+    Values of `node` on the union index, and the mask of the rows that exist
+    in `node` (the rows of its operands, None for a scalar). As in the eager
+    operators, the default of `node` is only used for these rows.
+    """
+    if isinstance(node, LazyVar):
+        left, left_present = _evaluate_arrays(node._left, arrays, present)
+        right, right_present = _evaluate_arrays(node._right, arrays, present)
+        result = ARRAY_OPERATIONS[node._op](
+            left, right, getattr(node._right, "default", None)
         )
+        if right_present is None:
+            node_present = left_present
+        else:
+            node_present = left_present | right_present
+        if node.default is not None:
+            result = np.where(np.isnan(result) & node_present, node.default, result)
+        return result, node_present
+    if isinstance(node, Var):
+        return arrays[id(node)], present[id(node)]
+    return node, None
+
+
+def _fill(a, b, fill_value):
+    # Same as the `fill_value` of the pandas operators: if only one of the
+    # two values is missing, it is replaced by `fill_value`
+    if fill_value is None:
+        return a, b
+    a_missing, b_missing = np.isnan(a), np.isnan(b)
+    a = np.where(a_missing & ~b_missing, fill_value, a)
+    b = np.where(b_missing & ~a_missing, fill_value, b)
+    return a, b
+
+
+def _fill_op(op):
+    return lambda a, b, fill_value: op(*_fill(a, b, fill_value))
+
+
+# Operators of Var on the values dataframes, and on aligned arrays (for LazyVar)
+OPERATIONS = {
+    "add": lambda a, b, fill_value: a.add(b, fill_value=fill_value),
+    "sub": lambda a, b, fill_value: a.sub(b, fill_value=fill_value),
+    "rsub": lambda a, b, fill_value: a.rsub(b, fill_value=fill_value),
+    "mul": lambda a, b, fill_value: a.mul(b, fill_value=fill_value),
+    "truediv": lambda a, b, fill_value: a.truediv(b, fill_value=fill_value),
+    "rtruediv": lambda a, b, fill_value: a.rtruediv(b, fill_value=fill_value),
+    "pow": lambda a, b, fill_value: a**b,
+}
+ARRAY_OPERATIONS = {
+    "add": _fill_op(operator.add),
+    "sub": _fill_op(operator.sub),
+    "rsub": _fill_op(lambda a, b: b - a),
+    "mul": _fill_op(operator.mul),
+    "truediv": _fill_op(operator.truediv),
+    "rtruediv": _fill_op(lambda a, b: b / a),
+    "pow": lambda a, b, fill_value: a**b,
+}
 
 
 class RegionalVar(Var):
@@ -519,7 +906,16 @@ class MetaVar(Var):
             self._year = metacolumn[0] if to_series else metacolumn
 
             # First get years that already exist
-            self._values = self.scenarios[self._year]
+            scenarios = self.scenarios
+            if isinstance(data, LazyImport):
+                scenarios = scenarios.assign(
+                    **{
+                        column: data.meta_column(column)
+                        for column in metacolumn
+                        if column not in scenarios.columns
+                    }
+                )
+            self._values = scenarios[self._year]
 
         if values is not None:
             if isinstance(values, pd.Series):
@@ -533,11 +929,89 @@ class MetaVar(Var):
             self._values = self._values.fillna(self.default)
 
 
+class SelectionCache:
+    """
+    Least-recently-used cache of the data selections of a `DataVar`, by
+    (variable, region, unit). Holds at most `maxsize` selections and, if
+    `max_bytes` is given, at most that many bytes of selections.
+    `hits` and `misses` count the lookups, to help sizing the cache.
+    """
+
+    def __init__(self, maxsize=128, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.years = None  # Year columns of the data
+        self._entries = OrderedDict()
+
+    def get(self, key, compute):
+        """Returns the cached value of `key`, or computes and stores it"""
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+        self.misses += 1
+        value = compute()
+        nbytes = _nbytes(value)
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        self._evict()
+        return value
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize or (
+            self.max_bytes is not None
+            and self.nbytes > self.max_bytes
+            and len(self._entries) > 1
+        ):
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self.years = None
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "nbytes": self.nbytes,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class DataVar:
-    def __init__(self, data, scenarios=None, vetted_scenarios=None, is_regional=False):
+    def __init__(
+        self,
+        data,
+        scenarios=None,
+        vetted_scenarios=None,
+        is_regional=False,
+        cache_size=128,
+        cache_bytes=None,
+        lazy=False,
+    ):
+        """
+        Selections of the data are cached (see `SelectionCache`, with
+        `cache_size` and `cache_bytes`). After changing `data` in place,
+        call `datavar.cache.clear()`. After changing columns of the metadata
+        in place, call `lookup.get_meta_index(meta).invalidate(column)`.
+
+        If `lazy`, arithmetic on the variables is only evaluated when the
+        values are used (see `LazyVar`).
+        """
         if scenarios is None:
             # If no metadata is provided, make an empty metadata dataframe
-            scenarios = data.groupby("Name").first()[["Model", "Scenario"]]
+            if isinstance(data, (DataCube, LazyImport)):
+                scenarios = data.create_scenarios()
+            else:
+                scenarios = create_scenarios(data)[["Model", "Scenario"]]
         if vetted_scenarios is None:
             vetted_scenarios = scenarios
         self.data = data
@@ -553,6 +1027,8 @@ class DataVar:
 
         # Create unit-dictionary
         self.units = self._create_unit_map()
+        self.cache = SelectionCache(cache_size, cache_bytes)
+        self.lazy = lazy
 
     def __call__(
         self, variable=None, year=None, meta=None, region=None, unit=None, **kwargs
@@ -581,14 +1057,84 @@ class DataVar:
             region=region,
             select_unit=select_unit,
             unit=unit,
+            cache=self.cache,
+            lazy=self.lazy,
             **kwargs,
         )
 
+    def panel(self, variables, meta=None, ip=None, ssp=None, long_format=False):
+        """
+        Values of multiple variables for one selection of scenarios, as one
+        dataframe with a column per (variable, year). The `meta`, `ip` and `ssp`
+        filters (see `Var.select`) are only evaluated once, for all variables.
+
+        `variables` is a list of variable names, or a dict {label: variable}
+        where each variable is a variable name, a dict with the arguments of
+        this DataVar (e.g. {"variable": ..., "year": 2050, "unit": ...})
+        or a `Var`. For a list, the labels are the variable names (or meta
+        columns), or "Variable <position>" if there is none. The unit of each
+        variable is in `panel.attrs["units"]`.
+
+            Example: datavar.panel(
+                {
+                    "CO2": {"variable": "Emissions|CO2", "year": [2030, 2050]},
+                    "Cum. CO2": {"meta": "Cum. CO2"},
+                },
+                meta={"Category": ["C1", "C2"]},
+            )
+        """
+        if not isinstance(variables, dict):
+            variables = _panel_labels(variables)
+        var_objs = {}
+        for label, variable in variables.items():
+            if isinstance(variable, dict):
+                variable = self(**variable)
+            elif not isinstance(variable, Var):
+                variable = self(variable)
+            var_objs[label] = variable
+
+        # Scenario selection, shared by all variables
+        first = next(iter(var_objs.values()))
+        selection, extra_columns = first._select_meta(meta)
+        selection, extra_columns = first._select_ip_ssp(
+            selection, extra_columns, ip, ssp
+        )
+
+        frames = {}
+        for label, variable in var_objs.items():
+            values = variable._select_values(selection.index)
+            values = values[values.index.get_level_values("Name").isin(selection.index)]
+            if isinstance(values, pd.Series):
+                values = values.to_frame(variable._year)
+            frames[label] = values
+        panel = pd.concat(frames, axis=1, names=["Variable", "Year"])
+
+        # Add the filtered meta columns to the index, and sort by them
+        if len(extra_columns) > 0:
+            positions = selection.index.get_indexer(
+                panel.index.get_level_values("Name")
+            )
+            meta_values = [selection[c].to_numpy()[positions] for c in extra_columns]
+            panel.index = pd.MultiIndex.from_arrays(
+                meta_values
+                + [panel.index.get_level_values(i) for i in range(panel.index.nlevels)],
+                names=extra_columns + list(panel.index.names),
+            )
+            order = np.lexsort([_sort_codes(v) for v in reversed(meta_values)])
+            panel = panel.iloc[order]
+
+        if long_format:
+            panel = panel.stack(["Variable", "Year"]).to_frame("Value").reset_index()
+        panel.attrs["units"] = {label: v.unit for label, v in var_objs.items()}
+        return panel
+
     def _create_unit_map(self):
         # Check if variables all map to one unit. If not, take the unit which occurs most often
+        if isinstance(self.data, (DataCube, LazyImport)):
+            return self.data.unit_map()
         try:
             units = (
-                self.data.groupby(["Variable", "Unit"])
+                self.data.groupby(["Variable", "Unit"], observed=True)
                 .count()
                 .iloc[:, 0]
                 .sort_values(ascending=False)
@@ -602,17 +1148,98 @@ class DataVar:
             return None
 
 
+def _year_columns(data):
+    if isinstance(data, (DataCube, LazyImport)):
+        return list(data.years)
+    return list(data.filter(regex="\d{4}").columns)
+
+
+def _cache_key(value):
+    if isinstance(value, (list, pd.Series)):
+        return tuple(value)
+    return value
+
+
+def _nbytes(value):
+    if isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    return 0
+
+
+def _panel_labels(variables):
+    # {label: variable} for a list of variables given as names, dicts of
+    # arguments or Vars
+    labels = [_panel_label(variable, i) for i, variable in enumerate(variables)]
+    duplicates = sorted({label for label in labels if labels.count(label) > 1})
+    if len(duplicates) > 0:
+        raise ValueError(
+            f"Duplicate panel labels {duplicates}, pass a dict {{label: variable}}"
+        )
+    return dict(zip(labels, variables))
+
+
+def _panel_label(variable, position):
+    if isinstance(variable, dict):
+        name = variable.get("variable", variable.get("meta"))
+    elif isinstance(variable, MetaVar):
+        name = variable._year if hasattr(variable, "_variable") else None
+    elif isinstance(variable, Var):
+        # Vars from arithmetic or `values` have no variable name
+        name = getattr(variable, "_variable", None)
+    else:
+        name = variable
+    return name if isinstance(name, str) else f"Variable {position}"
+
+
+def _remove_unused_categories(df):
+    # Only keep the categories of the selected rows, otherwise groupby
+    # returns a group for each unused category
+    return df.assign(
+        **{
+            column: df[column].cat.remove_unused_categories()
+            for column in df.columns
+            if isinstance(df[column].dtype, pd.CategoricalDtype)
+        }
+    )
+
+
 def _to_list(value, to_str=False):
     if isinstance(value, (tuple, list, pd.Series)):
         return [str(v) for v in value] if to_str else value
     return [str(value)] if to_str else [value]
 
 
-def _all_row(mask):
+def _sort_codes(values):
+    # Codes of values in sorted order, missing values last (as in sort_values)
+    codes = pd.factorize(values, sort=True)[0]
+    return np.where(codes == -1, len(codes), codes)
+
+
+def _value_mask(values, conditions, years="all"):
     """
-    Returns mask.all(axis=1) if mask is a dataframe.
-    If mask is a series returns mask
+    Mask of the rows of `values` that are equal to one of the values or
+    within one of the ranges (pd.Interval) in `conditions`, in all years
+    (or in any year if `years` is "any"). All conditions are evaluated in
+    one pass over the value matrix.
     """
-    if isinstance(mask, pd.DataFrame):
-        return mask.all(axis=1)
-    return mask
+    if years not in ["all", "any"]:
+        raise ValueError(f"{years} is not a valid option for value_years [all, any]")
+    array = values.to_numpy(float)
+    if array.ndim == 1:
+        array = array[:, None]
+    # Exact values are ranges [v, v]
+    low = np.array(
+        [v.left if isinstance(v, pd.Interval) else v for v in conditions], dtype=float
+    )
+    high = np.array(
+        [v.right if isinstance(v, pd.Interval) else v for v in conditions], dtype=float
+    )
+    # (row, year, condition)
+    within = (array[:, :, None] >= low) & (array[:, :, None] <= high)
+    if years == "any":
+        return within.any(axis=(1, 2))
+    return within.all(axis=1).any(axis=1)
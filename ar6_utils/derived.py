@@ -0,0 +1,206 @@
+import operator
+from dataclasses import dataclass
+from functools import reduce
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .data import append_data
+from .lookup import select_rows
+
+OPERATIONS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "/": operator.truediv,
+    "*": operator.mul,
+}
+
+KEY_COLUMNS = ["Model", "Scenario", "Name", "Region", "Unit"]
+
+
+@dataclass
+class DerivedVariable:
+    """
+    Variable `name` = inputs[0] `op` inputs[1] `op` ... (evaluated left to right).
+
+    Inputs can be variables of the data or other derived variables.
+    - default:  value used for a missing input, in years where another input
+                is available. Either one value for all inputs or a list with
+                one value (or None) per input.
+    - unit:     if given, the inputs are combined regardless of their unit,
+                and the new variable gets this unit.
+    - required: if False, the variable is skipped if one of the inputs does
+                not exist. Otherwise a KeyError is raised.
+    """
+
+    name: str
+    inputs: List[str]
+    op: str = "+"
+    default: Optional[object] = None
+    unit: Optional[str] = None
+    required: bool = True
+
+    def defaults(self):
+        if isinstance(self.default, (tuple, list)):
+            return list(self.default)
+        return [self.default] * len(self.inputs)
+
+
+def add_derived_variables(data, derived_variables, append=True):
+    """
+    Computes all derived variables in one pass over a (row, variable, year)
+    block of the input variables, and appends them to `data` at once.
+    """
+    derived_variables = _sort_dependencies(derived_variables)
+    derived_names = {d.name for d in derived_variables}
+    input_variables = list(
+        {v for d in derived_variables for v in d.inputs if v not in derived_names}
+    )
+    years = [c for c in data.columns if isinstance(c, (int, np.integer))]
+    block = _Block(select_rows(data, input_variables), years)
+
+    new_variables = []
+    for derived in derived_variables:
+        missing = [v for v in derived.inputs if not block.exists(v)]
+        if len(missing) > 0:
+            if derived.required:
+                raise KeyError(missing[0])
+            continue
+        block.compute(derived)
+        new_variables.append(derived.name)
+
+    new_rows = block.to_data(new_variables)
+    if append:
+        return append_data(data, new_rows)
+    return new_rows
+
+
+def _sort_dependencies(derived_variables):
+    """Sorts the derived variables such that each comes after its inputs"""
+    by_name = {d.name: d for d in derived_variables}
+    ordered, visiting, done = [], set(), set()
+
+    def visit(derived):
+        if derived.name in done:
+            return
+        if derived.name in visiting:
+            raise ValueError(f"Circular dependency for derived variable {derived.name}")
+        visiting.add(derived.name)
+        for variable in derived.inputs:
+            if variable in by_name:
+                visit(by_name[variable])
+        visiting.remove(derived.name)
+        done.add(derived.name)
+        ordered.append(derived)
+
+    for derived in derived_variables:
+        visit(derived)
+    return ordered
+
+
+def _factorize_rows(frame):
+    """Code of each row of `frame`, and the dataframe of unique rows"""
+    if len(frame) == 0:
+        return np.array([], dtype=np.intp), frame.reset_index(drop=True)
+    codes, uniques = pd.MultiIndex.from_frame(frame).factorize()
+    return codes, uniques.to_frame(index=False, name=list(frame.columns))
+
+
+class _Block:
+    """
+    Values of a set of variables as (row, year) arrays, where the rows are the
+    unique (Model, Scenario, Name, Region, Unit) combinations.
+    """
+
+    def __init__(self, data, years):
+        self.years = years
+        key_codes, self.keys = _factorize_rows(data[KEY_COLUMNS].astype(object))
+        self.values = {}
+        self.present = {}
+
+        variable_codes, variables = pd.factorize(data["Variable"])
+        values = data[years].to_numpy(float)
+        for i, variable in enumerate(variables):
+            rows = key_codes[variable_codes == i]
+            if len(np.unique(rows)) != len(rows):
+                raise ValueError(f"Index contains duplicate entries for {variable}")
+            self.values[variable] = np.full((len(self.keys), len(years)), np.nan)
+            self.values[variable][rows] = values[variable_codes == i]
+            self.present[variable] = ~np.isnan(self.values[variable]).all(axis=1)
+
+    def exists(self, variable):
+        return variable in self.values and self.present[variable].any()
+
+    def compute(self, derived):
+        if derived.unit is None:
+            rows = np.arange(len(self.keys))
+            inputs = [self.values[v] for v in derived.inputs]
+        else:
+            rows, inputs = self._combine_units(derived)
+
+        # Only years in which at least one of the inputs has a value
+        has_value = reduce(np.logical_or, [~np.isnan(v) for v in inputs])
+        inputs = [
+            v if default is None else np.where(np.isnan(v), default, v)
+            for v, default in zip(inputs, derived.defaults())
+        ]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = reduce(OPERATIONS[derived.op], inputs)
+        result = np.where(has_value, result, np.nan)
+
+        self.values[derived.name] = np.full((len(self.keys), len(self.years)), np.nan)
+        self.values[derived.name][rows] = result
+        self.present[derived.name] = np.zeros(len(self.keys), dtype=bool)
+        self.present[derived.name][rows] = has_value.any(axis=1)
+
+    def _combine_units(self, derived):
+        # Combine the inputs per (Model, Scenario, Name, Region), regardless of unit
+        group_columns = [c for c in KEY_COLUMNS if c != "Unit"]
+        group_codes, groups = _factorize_rows(self.keys[group_columns])
+        inputs = []
+        for variable in derived.inputs:
+            rows = np.flatnonzero(self.present[variable])
+            if len(np.unique(group_codes[rows])) != len(rows):
+                raise ValueError(f"Index contains duplicate entries for {variable}")
+            values = np.full((len(groups), len(self.years)), np.nan)
+            values[group_codes[rows]] = self.values[variable][rows]
+            inputs.append(values)
+
+        # Rows of the new variable: the groups with the new unit
+        new_keys = groups.assign(Unit=derived.unit)
+        rows = self._add_keys(new_keys)
+        return rows, inputs
+
+    def _add_keys(self, new_keys):
+        """Adds the keys that do not exist yet, returns the rows of all `new_keys`"""
+        all_keys = pd.MultiIndex.from_frame(self.keys)
+        rows = all_keys.get_indexer(pd.MultiIndex.from_frame(new_keys[KEY_COLUMNS]))
+        is_new = rows == -1
+        rows[is_new] = len(self.keys) + np.arange(is_new.sum())
+        if is_new.any():
+            self.keys = pd.concat(
+                [self.keys, new_keys.loc[is_new, KEY_COLUMNS]], ignore_index=True
+            )
+            padding = np.full((is_new.sum(), len(self.years)), np.nan)
+            for variable in self.values:
+                self.values[variable] = np.concatenate([self.values[variable], padding])
+                self.present[variable] = np.concatenate(
+                    [self.present[variable], np.zeros(is_new.sum(), dtype=bool)]
+                )
+        return rows
+
+    def to_data(self, variables):
+        """Long-format data dataframe of `variables`"""
+        frames = []
+        for variable in variables:
+            rows = np.flatnonzero(self.present[variable])
+            frame = self.keys.iloc[rows].reset_index(drop=True)
+            frame.insert(4, "Variable", variable)
+            values = pd.DataFrame(self.values[variable][rows], columns=self.years)
+            frames.append(pd.concat([frame, values], axis=1))
+        if len(frames) == 0:
+            return pd.DataFrame(
+                columns=KEY_COLUMNS[:4] + ["Variable", "Unit"] + self.years
+            )
+        return pd.concat(frames, ignore_index=True)
@@ -2,6 +2,9 @@ import colorsys
 
 import numpy as np
 
+# np.trapz is renamed to np.trapezoid in NumPy 2.0
+trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
 
 class variables:
     DELTA_T = 10
@@ -64,4 +67,4 @@ def lighten_hex(hex, extra_lightness=0.1, extra_saturation=0.0):
 
 def linearInterp(row):
     years = row.index.astype(float)
-    return np.trapz(row, x=years)
+    return trapezoid(row, x=years)
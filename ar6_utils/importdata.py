@@ -1,21 +1,30 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+import openpyxl
 import pandas as pd
 
+from . import cache
 from .constants import IP_SCENARIOS, SSP_SCENARIOS, YEARS
 
-from .generalutils import linearInterp, variables
+from .corrections import Correction, apply_corrections, to_corrections
+from .derived import DerivedVariable, add_derived_variables
+from .generalutils import variables
+from .indicators import Indicator, add_indicators
+from .lookup import get_index, select_rows
+from .units import UNIT_CONVERSIONS, convert_units
 from .data import (
-    add_variable_range,
-    add_variable_year,
     calc_netzero,
+    concat_data,
     create_scenarios,
-    create_variable,
     prepare_data,
+    replace_values,
+    scenario_fingerprints,
 )
 
 VETTING_COL = "Vetting_historical"
+FINGERPRINT_COL = "Fingerprint"
 
 
 def import_data(
@@ -29,34 +38,238 @@ def import_data(
     startyear=2010,
     endyear=2100,
     fix_imp_data=True,
+    regions=None,
+    variables=None,
+    chunksize=None,
+    extra_variables=None,
+    corrections=None,
+    meta_columns=None,
+    cache_folder=None,
+    lazy=False,
 ):
-    # Import the normal data file
-    print("Importing data...")
-    data = prepare_data(
-        os.path.join(snapshot_folder, data_filename),
+    """
+    Imports the snapshot data file (and optionally the meta file) into a
+    long-format data dataframe and a scenarios (meta) dataframe.
+
+    Use `regions` and `variables` to only import a subset of the data file,
+    and `chunksize` to stream the data file in chunks of that many rows
+    (see `prepare_data`).
+
+    If `extra`, the derived variables of `EXTRA_VARIABLES` are added, and
+    those of `extra_variables` (a list of `derived.DerivedVariable`s).
+
+    `corrections` is a list (or dataframe) of `corrections.Correction`s, which
+    are applied after the corrections of the IMP data (if `fix_imp_data`).
+
+    `meta_columns` are the columns of the meta sheet to import (all if None),
+    see `read_meta`.
+
+    If `cache_folder` is given, the result is stored on disk in this folder.
+    The cache is keyed by the contents of the snapshot files and by all other
+    arguments, so a changed snapshot or argument automatically invalidates it.
+
+    If `lazy`, only the data file is parsed (and corrected), and a `LazyImport`
+    handle is returned which computes the rest when it is used. The cache is
+    not used in that case.
+    """
+    if corrections is not None:
+        corrections = to_corrections(corrections)
+
+    if lazy:
+        raw = _read_data_file(
+            os.path.join(snapshot_folder, data_filename),
+            dt,
+            onlyworld,
+            startyear,
+            endyear,
+            fix_imp_data,
+            regions,
+            variables,
+            chunksize,
+            corrections,
+        )
+        print("Finished.")
+        return LazyImport(
+            raw,
+            snapshot_folder,
+            meta_filename,
+            extra=extra,
+            convert_units=convert_units,
+            extra_variables=extra_variables,
+            meta_columns=meta_columns,
+            unit_conversions=dict(UNIT_CONVERSIONS),
+        )
+
+    if cache_folder is not None:
+        files = [os.path.join(snapshot_folder, data_filename)]
+        if meta_filename is not None:
+            files.append(os.path.join(snapshot_folder, meta_filename))
+        key = cache.cache_key(
+            files,
+            meta=meta_filename is not None,
+            dt=dt,
+            extra=extra,
+            onlyworld=onlyworld,
+            convert_units=convert_units,
+            startyear=startyear,
+            endyear=endyear,
+            fix_imp_data=fix_imp_data,
+            regions=regions,
+            variables=variables,
+            extra_variables=extra_variables,
+            corrections=corrections,
+            meta_columns=meta_columns,
+            unit_conversions=(
+                sorted(UNIT_CONVERSIONS.items()) if convert_units else None
+            ),
+        )
+        cached = cache.load(cache_folder, key)
+        if cached is not None:
+            print("Loaded from cache.")
+            return cached
+
+    result = _import_data(
+        snapshot_folder,
+        data_filename,
+        meta_filename=meta_filename,
         dt=dt,
+        extra=extra,
         onlyworld=onlyworld,
+        convert_units=convert_units,
         startyear=startyear,
         endyear=endyear,
+        fix_imp_data=fix_imp_data,
+        regions=regions,
+        variables=variables,
+        chunksize=chunksize,
+        extra_variables=extra_variables,
+        corrections=corrections,
+        meta_columns=meta_columns,
     )
 
-    if fix_imp_data:
-        data = _fix_imp_ld_neg(data)
+    if cache_folder is not None:
+        cache.save(cache_folder, key, result)
+    return result
 
-    if extra:
-        print("Creating extra variables...")
-        data = _create_extra_variables(data)
 
-    # Convert units to GtCO2 etc
-    if convert_units:
-        print("Converting to standard units...")
-        _convert_units(data)
+def import_data_files(
+    snapshot_folder,
+    data_filenames,
+    meta_filename=None,
+    dt=5,
+    extra=True,
+    onlyworld=True,
+    convert_units=True,
+    startyear=2010,
+    endyear=2100,
+    fix_imp_data=True,
+    regions=None,
+    variables=None,
+    chunksize=None,
+    extra_variables=None,
+    corrections=None,
+    meta_columns=None,
+    max_workers=None,
+):
+    """
+    Imports several data files (e.g. the global, R5 and R10 snapshots) at once.
+    Each file is read, corrected, extended with the extra variables and converted
+    in a separate process (at most `max_workers`, by default one per file up to
+    the number of cores). The results are merged into one data dataframe with
+    common categories. Rows of a (Name, Region, Variable) that occur in more than
+    one file are taken from the first file that contains them.
+
+    The other arguments are the same as for `import_data`.
+    """
+    if corrections is not None:
+        corrections = to_corrections(corrections)
+    paths = [os.path.join(snapshot_folder, filename) for filename in data_filenames]
+    kwargs = dict(
+        dt=dt,
+        extra=extra,
+        onlyworld=onlyworld,
+        convert_units=convert_units,
+        startyear=startyear,
+        endyear=endyear,
+        fix_imp_data=fix_imp_data,
+        regions=regions,
+        variables=variables,
+        chunksize=chunksize,
+        extra_variables=extra_variables,
+        corrections=corrections,
+        # Pass the conversions explicitly: registered conversions are not
+        # available in spawned worker processes
+        unit_conversions=dict(UNIT_CONVERSIONS),
+    )
+
+    if max_workers is None:
+        max_workers = min(len(paths), os.cpu_count() or 1)
+    if max_workers <= 1 or len(paths) <= 1:
+        results = [_import_data_file(path, **kwargs) for path in paths]
+    else:
+        print(f"Importing {len(paths)} data files in {max_workers} processes...")
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_import_data_file, path, **kwargs) for path in paths
+            ]
+            results = [future.result() for future in futures]
+
+    data = concat_data(results, ignore_index=True)
+    duplicated = data.duplicated(["Name", "Region", "Variable"])
+    if duplicated.any():
+        data = data[~duplicated].reset_index(drop=True)
+    get_index(data, rebuild=True)
+
+    if meta_filename is not None:
+        print("Creating metadata...")
+        scenarios = _create_metadata_df(
+            data, snapshot_folder, meta_filename, fast=not extra, columns=meta_columns
+        )
+        print("Finished.")
+        return data, scenarios
+    print("Finished.")
+    return data
+
+
+def _import_data(
+    snapshot_folder,
+    data_filename,
+    meta_filename,
+    dt,
+    extra,
+    onlyworld,
+    convert_units,
+    startyear,
+    endyear,
+    fix_imp_data,
+    regions,
+    variables,
+    chunksize,
+    extra_variables,
+    corrections,
+    meta_columns,
+):
+    data = _import_data_file(
+        os.path.join(snapshot_folder, data_filename),
+        dt=dt,
+        extra=extra,
+        onlyworld=onlyworld,
+        convert_units=convert_units,
+        startyear=startyear,
+        endyear=endyear,
+        fix_imp_data=fix_imp_data,
+        regions=regions,
+        variables=variables,
+        chunksize=chunksize,
+        extra_variables=extra_variables,
+        corrections=corrections,
+    )
 
     # Create scenarios dataframe
     if meta_filename is not None:
         print("Creating metadata...")
         scenarios = _create_metadata_df(
-            data, snapshot_folder, meta_filename, fast=not extra
+            data, snapshot_folder, meta_filename, fast=not extra, columns=meta_columns
         )
 
         print("Finished.")
@@ -65,194 +278,489 @@ def import_data(
     return data
 
 
-def _fix_imp_ld_neg(data):
+def _import_data_file(
+    path,
+    dt,
+    extra,
+    onlyworld,
+    convert_units,
+    startyear,
+    endyear,
+    fix_imp_data,
+    regions,
+    variables,
+    chunksize,
+    extra_variables,
+    corrections,
+    unit_conversions=None,
+):
+    data = _read_data_file(
+        path,
+        dt,
+        onlyworld,
+        startyear,
+        endyear,
+        fix_imp_data,
+        regions,
+        variables,
+        chunksize,
+        corrections,
+    )
+
+    if extra:
+        print("Creating extra variables...")
+        data = _create_extra_variables(data, extra_variables)
+
+    # Convert units to GtCO2 etc
+    if convert_units:
+        print("Converting to standard units...")
+        _convert_units(data, unit_conversions)
 
-    def get(name, variable, values_only=True):
-        _select = data[(data["Name"] == name) & (data["Variable"] == variable)].copy()
-        if len(_select) == 0:
-            return 0.0
-        if len(_select) > 1:
-            print(f"Multiple entries for {name} - {variable}")
-        _select.fillna(0.0, inplace=True)
-        if values_only:
-            return _select.iloc[0].loc[2010:]
-        return _select.iloc[0]
-
-    name_neg = "COFFEE 1.1 EN_NPi2020_400f_lowBECCS"
-    extra1 = get(name_neg, "Primary Energy", False)
-    extra1.loc[2010:] = get(name_neg, "Primary Energy|Biomass|Modern|w/ CCS") + get(
-        name_neg, "Primary Energy|Biomass|Modern|w/o CCS"
+    return data
+
+
+def _read_data_file(
+    path,
+    dt,
+    onlyworld,
+    startyear,
+    endyear,
+    fix_imp_data,
+    regions,
+    variables,
+    chunksize,
+    corrections,
+):
+    # Import the normal data file
+    print("Importing data...")
+    data = prepare_data(
+        path,
+        dt=dt,
+        onlyworld=onlyworld,
+        startyear=startyear,
+        endyear=endyear,
+        regions=regions,
+        variables=variables,
+        chunksize=chunksize,
     )
-    extra1["Variable"] = "Primary Energy|Biomass|Modern"
-    data = data[
-        ~(
-            (data["Name"] == name_neg)
-            & (data["Variable"] == "Primary Energy|Biomass|Modern")
-        )
-    ]
 
-    extra2 = get(name_neg, "Primary Energy", False)
-    extra2.loc[2010:] = get(name_neg, "Primary Energy|Biomass") - extra1.loc[2010:]
-    extra2["Variable"] = "Primary Energy|Biomass|Traditional"
+    if fix_imp_data:
+        data = _fix_imp_ld_neg(data)
 
-    name_ld = "MESSAGEix-GLOBIOM 1.0 LowEnergyDemand_1.3_IPCC"
-    extra3 = get(name_ld, "Primary Energy|Biomass", False)
-    extra3["Variable"] = "Primary Energy|Biomass|Modern"
+    if corrections is not None:
+        data = apply_corrections(data, corrections)
 
-    data = pd.concat([data, pd.DataFrame([extra1, extra2, extra3])])
     return data
 
 
-def _create_extra_variables(data):
-    # Energy supply = 'Emissions|CO2|Energy|Supply' +  'Carbon Sequestration|CCS|Biomass'
-    # data = create_variable(data, 'Emissions|CO2|Energy|Supply', 'Carbon Sequestration|CCS|Biomass', 'Energy Supply', '+')
+class LazyImport:
+    """
+    Handle on a parsed (and corrected) data file, returned by
+    `import_data(..., lazy=True)`. The extra variables, the unit conversion
+    and the meta columns calculated from the data are only computed when
+    they are first used, and are then memoized.
+
+    - `select(variables)`:  rows of `variables`, as in the fully imported data.
+                            Only these variables are derived and converted.
+    - `meta`:               meta dataframe without the columns of `META_STAGES`,
+                            which are added when requested with `meta_column`
+    - `data`:               the fully imported data
+    - `compute()`:          the fully imported data and meta dataframe
+
+    A `DataVar` can be built on the handle: `DataVar(handle, handle.meta)`
+    """
+
+    def __init__(
+        self,
+        raw,
+        snapshot_folder=None,
+        meta_filename=None,
+        extra=True,
+        convert_units=True,
+        extra_variables=None,
+        meta_columns=None,
+        unit_conversions=None,
+    ):
+        self.raw = raw
+        self.years = [c for c in raw.columns if isinstance(c, (int, np.integer))]
+        self.snapshot_folder = snapshot_folder
+        self.meta_filename = meta_filename
+        self.extra = extra
+        self.convert_units = convert_units
+        self.extra_variables = [] if extra_variables is None else list(extra_variables)
+        self.meta_columns = meta_columns
+        self.unit_conversions = unit_conversions
+
+        self._rows = {}
+        self._data = None
+        self._meta = None
+
+    def select(self, variables):
+        """Rows of `variables` (a variable or list of variables)"""
+        if not isinstance(variables, (tuple, list)):
+            variables = [variables]
+        missing = [v for v in dict.fromkeys(variables) if v not in self._rows]
+        if len(missing) > 0:
+            rows = self._compute_variables(missing)
+            for variable in missing:
+                self._rows[variable] = rows[rows["Variable"] == variable]
+        if len(variables) == 0:
+            return self.raw.iloc[:0]
+        selection = concat_data([self._rows[v] for v in variables], ignore_index=True)
+        get_index(selection)
+        return selection
+
+    def _compute_variables(self, variables):
+        if self._data is not None:
+            return select_rows(self._data, variables)
+        if not self.extra:
+            rows = select_rows(self.raw, variables).copy()
+        else:
+            # Original names of the variables, and the derived variables they need
+            original_names = {new: old for old, new in VARIABLE_RENAMES.items()}
+            names = [original_names.get(v, v) for v in variables]
+            derived_variables = _required_derived_variables(
+                names, EXTRA_VARIABLES + self.extra_variables
+            )
+            derived_names = {d.name for d in derived_variables}
+            inputs = [v for d in derived_variables for v in d.inputs]
+            raw_variables = [v for v in names + inputs if v not in derived_names]
+            rows = select_rows(self.raw, list(dict.fromkeys(raw_variables)))
+            rows = _add_extra_variables(rows, derived_variables)
+        if self.convert_units:
+            _convert_units(rows, self.unit_conversions)
+        return rows
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.extra:
+                data = _create_extra_variables(self.raw, self.extra_variables)
+            else:
+                data = self.raw.copy()
+            if self.convert_units:
+                _convert_units(data, self.unit_conversions)
+            self._data = data
+        return self._data
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            if self.meta_filename is None:
+                self._meta = create_scenarios(self.raw)
+            else:
+                vetting_df = _get_vetting(
+                    self.snapshot_folder, self.meta_filename, self.meta_columns
+                )
+                self._meta = _calc_base_metadata(self.raw, vetting_df)
+                _add_missing_ip_ssp(self._meta)
+        return self._meta
+
+    def meta_column(self, column):
+        """Column of the meta dataframe, which is calculated first if needed"""
+        if column not in self.meta.columns:
+            for columns, stage_variables, function in META_STAGES:
+                if column in columns:
+                    function(self.meta, self.select(stage_variables))
+                    break
+            else:
+                raise KeyError(f"{column} is not an existing column in the metadata")
+        return self.meta[column]
+
+    def compute(self):
+        """Returns the fully imported data and meta dataframe"""
+        for columns, _, _ in META_STAGES:
+            self.meta_column(columns[0])
+        return self.data, self.meta
+
+    def create_scenarios(self):
+        return create_scenarios(self.raw)
+
+    def unit_map(self):
+        return _LazyUnits(self)
+
+
+class _LazyUnits(dict):
+    """Most common unit of each variable, looked up when first requested"""
+
+    def __init__(self, handle):
+        super().__init__()
+        self._handle = handle
+
+    def get(self, variable, default=None):
+        if variable not in self:
+            counts = self._handle.select(variable)["Unit"].value_counts()
+            has_unit = len(counts) > 0 and counts.iloc[0] > 0
+            self[variable] = counts.index[0] if has_unit else None
+        unit = dict.get(self, variable)
+        return default if unit is None else unit
+
+
+def _required_derived_variables(names, derived_variables):
+    # Derived variables of `names` and, recursively, of their inputs
+    by_name = {d.name: d for d in derived_variables}
+    required = {}
+    stack = list(names)
+    while len(stack) > 0:
+        name = stack.pop()
+        if name in by_name and name not in required:
+            required[name] = by_name[name]
+            stack.extend(by_name[name].inputs)
+    return [d for d in derived_variables if d.name in required]
+
+
+IMP_CORRECTIONS = [
+    # Biomass of IMP-Neg: recompute modern and traditional biomass
+    Correction(
+        "COFFEE 1.1 EN_NPi2020_400f_lowBECCS",
+        "Primary Energy|Biomass|Modern",
+        "recompute",
+        [
+            "Primary Energy|Biomass|Modern|w/ CCS",
+            "Primary Energy|Biomass|Modern|w/o CCS",
+        ],
+        "+",
+    ),
+    Correction(
+        "COFFEE 1.1 EN_NPi2020_400f_lowBECCS",
+        "Primary Energy|Biomass|Traditional",
+        "recompute",
+        ["Primary Energy|Biomass", "Primary Energy|Biomass|Modern"],
+        "-",
+    ),
+    # Biomass of IMP-LD: all biomass is modern biomass
+    Correction(
+        "MESSAGEix-GLOBIOM 1.0 LowEnergyDemand_1.3_IPCC",
+        "Primary Energy|Biomass|Modern",
+        "recompute",
+        ["Primary Energy|Biomass"],
+    ),
+]
 
-    # Industry = 'Emissions|CO2|Energy|Demand|Industry' +  'Emissions|CO2|Industrial Processes'
-    try:
-        data = create_variable(
-            data,
-            "Emissions|CO2|Energy|Demand|Industry",
-            "Emissions|CO2|Industrial Processes",
-            "Industry",
-            "+",
-            default_var1=0.0,
-            default_var2=0.0,
-        )
-    except KeyError:
-        pass
 
+def _fix_imp_ld_neg(data):
+    return apply_corrections(data, IMP_CORRECTIONS)
+
+
+# Energy supply = 'Emissions|CO2|Energy|Supply' +  'Carbon Sequestration|CCS|Biomass'
+# DerivedVariable("Energy Supply", ["Emissions|CO2|Energy|Supply", "Carbon Sequestration|CCS|Biomass"])
+EXTRA_VARIABLES = [
+    # Industry = 'Emissions|CO2|Energy|Demand|Industry' +  'Emissions|CO2|Industrial Processes'
+    DerivedVariable(
+        "Industry",
+        ["Emissions|CO2|Energy|Demand|Industry", "Emissions|CO2|Industrial Processes"],
+        "+",
+        default=0.0,
+        required=False,
+    ),
     # Other Energy Demand = 'Emissions|CO2|Energy|Demand|AFOFI' +  'Emissions|CO2|Energy|Demand|Other Sector'
-    try:
-        data = create_variable(
-            data,
+    DerivedVariable(
+        "Other Energy Demand",
+        [
             "Emissions|CO2|Energy|Demand|AFOFI",
             "Emissions|CO2|Energy|Demand|Other Sector",
-            "Other Energy Demand",
-            "+",
-            default_var1=0.0,
-            default_var2=0.0,
-        )
-    except KeyError:
-        pass
+        ],
+        "+",
+        default=0.0,
+        required=False,
+    ),
     # Energy supply -- negative
-    try:
-        data = create_variable(
-            data,
-            "Carbon Sequestration|CCS|Biomass",
-            "Carbon Sequestration|Direct Air Capture",
-            "Carbon Sequestration|BECCS+DAC",
-            "+",
-            default_var1=0.0,
-            default_var2=0.0,
-        )
-    except KeyError:
-        pass
+    DerivedVariable(
+        "Carbon Sequestration|BECCS+DAC",
+        ["Carbon Sequestration|CCS|Biomass", "Carbon Sequestration|Direct Air Capture"],
+        "+",
+        default=0.0,
+        required=False,
+    ),
     # Energy supply -- positive
-    # try:
-    #     data = create_variable(
-    #         data,
-    #         "Emissions|CO2|Energy|Supply",
-    #         "Carbon Sequestration|BECCS+DAC",
-    #         "Emissions|CO2|Energy|Supply Gross Positive",
-    #         "+",
-    #         default_var1=0.0,
-    #         default_var2=0.0,
-    #     )
-    # except KeyError:
-    #     pass
-
-    data = create_variable(
-        data,
-        "Emissions|CO2|Energy|Demand|Residential and Commercial",
-        "Emissions|CO2|Energy|Demand|Transportation",
+    # DerivedVariable(
+    #     "Emissions|CO2|Energy|Supply Gross Positive",
+    #     ["Emissions|CO2|Energy|Supply", "Carbon Sequestration|BECCS+DAC"],
+    #     "+",
+    #     default=0.0,
+    #     required=False,
+    # ),
+    DerivedVariable(
         "Buildings+Transport",
+        [
+            "Emissions|CO2|Energy|Demand|Residential and Commercial",
+            "Emissions|CO2|Energy|Demand|Transportation",
+        ],
         "+",
-        default_var1=0.0,
-        default_var2=0.0,
-    )
-    data = create_variable(
-        data,
-        "Buildings+Transport",
-        "Industry",
+        default=0.0,
+    ),
+    DerivedVariable(
         "Buildings+Transport+Industry",
+        ["Buildings+Transport", "Industry"],
         "+",
-        default_var1=0.0,
-        default_var2=0.0,
-    )
-    data = create_variable(
-        data,
-        "Buildings+Transport+Industry",
-        "Carbon Sequestration|BECCS+DAC",
+        default=0.0,
+    ),
+    DerivedVariable(
         "Buildings+Transport+Industry-Carbon Sequestration",
+        ["Buildings+Transport+Industry", "Carbon Sequestration|BECCS+DAC"],
         "-",
-        default_var1=0.0,
-        default_var2=0.0,
-    )
-    data = create_variable(
-        data,
-        "Emissions|CO2|Energy and Industrial Processes",
-        "Buildings+Transport+Industry-Carbon Sequestration",
+        default=0.0,
+    ),
+    DerivedVariable(
         "Emissions|CO2|Energy|Supply Gross Positive",
+        [
+            "Emissions|CO2|Energy and Industrial Processes",
+            "Buildings+Transport+Industry-Carbon Sequestration",
+        ],
         "-",
-    )
-
-    # Non-CO2 emissions
-    try:
-        data = create_variable(
-            data,
-            variables.KYOTO,
-            "Emissions|CO2",
-            "Emissions|Non-CO2",
-            "-",
-            overwrite_unit="Mt CO2-equiv/yr",
-        )
-    except KeyError:
-        pass
+    ),
     # Other = 'Emissions|CO2|Other' +  'Emissions|CO2|Waste'
-    # data = create_variable(data, 'Emissions|CO2|Other', 'Emissions|CO2|Waste', 'Other', '+')
+    # DerivedVariable("Other", ["Emissions|CO2|Other", "Emissions|CO2|Waste"]),
+    # Non-CO2 emissions
+    DerivedVariable(
+        "Emissions|Non-CO2",
+        [variables.KYOTO, "Emissions|CO2"],
+        "-",
+        unit="Mt CO2-equiv/yr",
+        required=False,
+    ),
+]
+
+
+# Existing variables that get a simpler name
+VARIABLE_RENAMES = {
+    "Carbon Sequestration|CCS|Biomass": "BECCS",
+    "Emissions|CO2|Energy|Supply": "Energy Supply",
+    "Carbon Sequestration|BECCS+DAC": "Energy Supply (neg.)",
+    "Emissions|CO2|Energy|Supply Gross Positive": "Energy Supply (pos.)",
+    "Emissions|CO2|AFOLU": "LULUCF",
+    "Emissions|CO2|Energy|Demand|Transportation": "Transport",
+    "Emissions|CO2|Energy|Demand|Residential and Commercial": "Buildings",
+    "Emissions|CO2|Other": "Other",
+}
+
+
+def _create_extra_variables(data, extra_variables=None):
+    """
+    Adds the derived variables of `EXTRA_VARIABLES` and `extra_variables`
+    (a list of `DerivedVariable`s) to the data
+    """
+    if extra_variables is None:
+        extra_variables = []
+    return _add_extra_variables(data, EXTRA_VARIABLES + list(extra_variables))
+
+
+def _add_extra_variables(data, derived_variables):
+    data = add_derived_variables(data, derived_variables)
+
     # Make CCS variables minus
     data.loc[data["Variable"].str.contains("CCS"), YEARS] *= -1
 
     # Rename existing variables to something simpler
-    var_rename = {
-        "Carbon Sequestration|CCS|Biomass": "BECCS",
-        "Emissions|CO2|Energy|Supply": "Energy Supply",
-        "Carbon Sequestration|BECCS+DAC": "Energy Supply (neg.)",
-        "Emissions|CO2|Energy|Supply Gross Positive": "Energy Supply (pos.)",
-        "Emissions|CO2|AFOLU": "LULUCF",
-        "Emissions|CO2|Energy|Demand|Transportation": "Transport",
-        "Emissions|CO2|Energy|Demand|Residential and Commercial": "Buildings",
-        "Emissions|CO2|Other": "Other",
-    }
-    for k, v in var_rename.items():
-        data.loc[data["Variable"] == k, "Variable"] = v
+    data["Variable"] = replace_values(data["Variable"], VARIABLE_RENAMES)
+    get_index(data, rebuild=True)
 
     return data
 
 
-def _convert_units(data):
-    for df, columns in [(data, YEARS)]:
-        # Convert unit Mt CO2/yr to Gt CO2/yr
-        df.loc[df["Unit"] == "Mt CO2/yr", columns] *= 0.001
-        df.loc[df["Unit"] == "Mt CO2/yr", "Unit"] = "Gt CO2/yr"
+def _convert_units(data, conversions=None):
+    # Convert units Mt CO2/yr to Gt CO2/yr etc, see `units.UNIT_CONVERSIONS`
+    convert_units(data, conversions)
 
-        # Convert unit Mt CH4/yr to Gt CH4/yr
-        # df.loc[df['Unit'] == 'Mt CH4/yr', columns] *= 0.001
-        # df.loc[df['Unit'] == 'Mt CH4/yr', 'Unit'] = 'Gt CH4/yr'
 
-        # Convert unit Kt N2O/yr to Mt N2O/yr
-        df.loc[df["Unit"] == "kt N2O/yr", columns] *= 0.001
-        df.loc[df["Unit"] == "kt N2O/yr", "Unit"] = "Mt N2O/yr"
+# Global indicators, also for data with multiple regions
+META_INDICATORS = [
+    Indicator("Cum. CO2", variables.CO2, "trapz", region="World"),
+    Indicator(
+        "GHG 2030",
+        variables.KYOTO,
+        "last",
+        year_low=2030,
+        year_high=2030,
+        region="World",
+    ),
+    Indicator(
+        "Total net negative", variables.CO2, "trapz", clip_upper=0, region="World"
+    ),
+]
 
-        # Convert unit Mt CO2-equiv/yr to Gt CO2-equiv/yr
-        df.loc[df["Unit"] == "Mt CO2-equiv/yr", columns] *= 0.001
-        df.loc[df["Unit"] == "Mt CO2-equiv/yr", "Unit"] = "Gt CO2-equiv/yr"
 
+def _create_metadata_df(data, folder, meta_filename, fast=False, columns=None):
+    print("   Importing vetting...")
+    vetting_df = _get_vetting(folder, meta_filename, columns)
+
+    meta = _calc_metadata(data, vetting_df, fast)
+    meta[FINGERPRINT_COL] = _fingerprints(data, vetting_df).reindex(meta.index)
+    _add_missing_ip_ssp(meta)
+    return meta
 
-def _create_metadata_df(data, folder, meta_filename, fast=False):
+
+def refresh_metadata(meta, data, folder, meta_filename, fast=False, columns=None):
+    """
+    Updates a meta dataframe created by `import_data` for a new revision
+    of the data. The meta columns are only recomputed for scenarios that are
+    new or of which the data rows or the meta sheet row changed (according to
+    their fingerprint), the other rows of `meta` are reused. Scenarios that
+    are no longer in `data` are removed.
+    """
     print("   Importing vetting...")
-    vetting_df = _get_vetting(folder, meta_filename)
+    vetting_df = _get_vetting(folder, meta_filename, columns)
+    fingerprints = _fingerprints(data, vetting_df)
+
+    if FINGERPRINT_COL in meta.columns:
+        old_fingerprints = meta[FINGERPRINT_COL].reindex(fingerprints.index)
+        changed = fingerprints.index[fingerprints != old_fingerprints]
+    else:
+        changed = fingerprints.index
+    unchanged = fingerprints.index.difference(changed)
+    print(
+        f"   Recalculating metadata of {len(changed)} of {len(fingerprints)} scenarios..."
+    )
 
+    new_meta = meta.loc[unchanged]
+    if len(changed) > 0:
+        changed_meta = _calc_metadata(
+            select_rows(data, name=list(changed)), vetting_df, fast
+        )
+        changed_meta[FINGERPRINT_COL] = fingerprints.reindex(changed_meta.index)
+        new_meta = pd.concat([new_meta, changed_meta])
+    new_meta = new_meta.sort_index()
+    _add_missing_ip_ssp(new_meta)
+    return new_meta
+
+
+def _fingerprints(data, vetting_df):
+    # Combine the hash of the data rows with the hash of the meta sheet row,
+    # as hexadecimal strings (such that missing fingerprints can be NaN)
+    fingerprints = scenario_fingerprints(data)
+    vetting_hashes = pd.util.hash_pandas_object(vetting_df, index=True)
+    vetting_hashes = vetting_hashes[~vetting_hashes.index.duplicated()]
+    fingerprints ^= vetting_hashes.reindex(fingerprints.index, fill_value=0)
+    return fingerprints.map("{:016x}".format)
+
+
+def _add_missing_ip_ssp(meta):
+    # Empty rows for the IP and SSP scenarios that are not in the data
+    for ip in IP_SCENARIOS.values():
+        if ip.scenario not in meta.index:
+            meta.loc[ip.scenario, "IP"] = ip.name
+    meta["SSP"] = meta["SSP"].fillna("")
+    for ssp in SSP_SCENARIOS.values():
+        if ssp.scenario not in meta.index:
+            meta.loc[ssp.scenario, "SSP"] = ssp.name
+
+
+def _calc_metadata(data, vetting_df, fast):
+    meta = _calc_base_metadata(data, vetting_df)
+
+    # CO2 emissions
+    if not fast:
+        print("   Calculating cumulative and peak emissions...")
+        _add_emission_indicators(meta, data)
+
+    # Calculate net-zero
+    print("   Calculating net-zero years...")
+    _add_netzero_years(meta, data)
+
+    return meta
+
+
+def _calc_base_metadata(data, vetting_df):
     meta = create_scenarios(data)
 
     # Merge with temperature category and vetting flags
@@ -267,41 +775,56 @@ def _create_metadata_df(data, folder, meta_filename, fast=False):
     # Add IP column (should be the same as IMP_marker, but this one depends on IP_SCENARIOS variable)
     meta["IP"] = ""
     for ip in IP_SCENARIOS.values():
-        meta.loc[ip.scenario, "IP"] = ip.name
+        meta.loc[meta.index == ip.scenario, "IP"] = ip.name
     # Add SSP column
     meta["SSP"] = ""
     for ssp in SSP_SCENARIOS.values():
-        meta.loc[ssp.scenario, "SSP"] = ssp.name
+        meta.loc[meta.index == ssp.scenario, "SSP"] = ssp.name
+    return meta
 
-    # CO2 emissions
-    if not fast:
-        print("   Calculating cumulative and peak emissions...")
-        add_variable_range(meta, data, "Cum. CO2", variables.CO2, linearInterp)
-        add_variable_year(meta, data, "GHG 2030", variables.KYOTO, year=2030)
-        add_variable_range(
-            meta, data, "Total net negative", variables.CO2, linearInterp, clip_upper=0
-        )
-        meta["Total net negative"] = -meta["Total net negative"]  # Make positive
-        meta["Peak cum. CO2"] = meta["Cum. CO2"] - meta["Total net negative"]
 
-    # Calculate net-zero
-    # print("   Calculating net-zero years...")
-    # calc_netzero(scenarios, data, variables.CO2, "Net zero CO2", limit=0.05)
-    # calc_netzero(scenarios, data, variables.KYOTO, "Net zero Kyoto")
-    # calc_netzero(
-    #     scenarios,
-    #     data,
-    #     "Emissions|CO2|Energy|Demand",
-    #     "Net zero Emissions|CO2|Energy|Demand",
-    # )
+def _add_emission_indicators(meta, data):
+    add_indicators(meta, data, META_INDICATORS)
+    meta["Total net negative"] = -meta["Total net negative"]  # Make positive
+    meta["Peak cum. CO2"] = meta["Cum. CO2"] - meta["Total net negative"]
 
-    return meta
 
+def _add_netzero_years(meta, data):
+    # Global net-zero years, also for data with multiple regions
+    calc_netzero(meta, data, variables.CO2, "Net zero CO2", limit=0.05, region="World")
+    calc_netzero(meta, data, variables.KYOTO, "Net zero Kyoto", region="World")
+    calc_netzero(
+        meta,
+        data,
+        "Emissions|CO2|Energy|Demand",
+        "Net zero Emissions|CO2|Energy|Demand",
+        region="World",
+    )
 
-def _get_vetting(folder, meta_filename):
-    vetting_df = pd.read_excel(
-        os.path.join(folder, meta_filename), sheet_name="meta", engine="openpyxl"
-    ).rename({"model": "Model", "scenario": "Scenario"}, axis="columns")
+
+# Meta columns calculated from the data: (columns, variables used, function)
+META_STAGES = [
+    (
+        ["Cum. CO2", "GHG 2030", "Total net negative", "Peak cum. CO2"],
+        [variables.CO2, variables.KYOTO],
+        _add_emission_indicators,
+    ),
+    (
+        ["Net zero CO2", "Net zero Kyoto", "Net zero Emissions|CO2|Energy|Demand"],
+        [variables.CO2, variables.KYOTO, "Emissions|CO2|Energy|Demand"],
+        _add_netzero_years,
+    ),
+]
+
+
+def _get_vetting(folder, meta_filename, columns=None):
+    if columns is not None:
+        columns = ["model", "scenario", VETTING_COL] + [
+            c for c in columns if c not in ["model", "scenario", VETTING_COL]
+        ]
+    vetting_df = read_meta(os.path.join(folder, meta_filename), columns=columns).rename(
+        {"model": "Model", "scenario": "Scenario"}, axis="columns"
+    )
     # Add column Name, equal to Model + Scenario
     vetting_df.insert(
         2, "Name", vetting_df["Model"] + " " + vetting_df["Scenario"].astype(str)
@@ -310,3 +833,74 @@ def _get_vetting(folder, meta_filename):
 
     vetting_df[VETTING_COL] = vetting_df[VETTING_COL].str.upper()
     return vetting_df
+
+
+def read_meta(path, sheet_name="meta", columns=None, use_cache=True):
+    """
+    Reads the sheet `sheet_name` of the meta workbook. The sheet is streamed
+    in read-only mode and only the `columns` are parsed (all columns if None).
+
+    If `use_cache`, the result is stored in a sidecar file next to the
+    workbook. It is used as long as the modification time and size of the
+    workbook are unchanged, or, if these changed, as long as its hash is
+    unchanged. Repeated imports then skip the Excel parsing.
+    """
+    sidecar = cache.cache_path(
+        os.path.dirname(path),
+        cache.cache_key([], sheet_name=sheet_name, columns=columns),
+        prefix=os.path.basename(path),
+    )
+    stat = os.stat(path)
+    if use_cache and os.path.exists(sidecar):
+        cached = pd.read_pickle(sidecar)
+        if (cached["mtime"], cached["size"]) == (stat.st_mtime, stat.st_size):
+            return cached["meta"].copy()
+        if cached["hash"] == cache.file_hash(path):
+            _save_meta_sidecar(sidecar, cached["meta"], stat, cached["hash"])
+            return cached["meta"].copy()
+
+    meta = _parse_meta_sheet(path, sheet_name, columns)
+    if use_cache:
+        _save_meta_sidecar(sidecar, meta, stat, cache.file_hash(path))
+    return meta
+
+
+def _parse_meta_sheet(path, sheet_name, columns):
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows)
+        if columns is None:
+            columns = [c for c in header if c is not None]
+        missing = [c for c in columns if c not in header]
+        if len(missing) > 0:
+            raise KeyError(f"Columns {missing} not in sheet {sheet_name} of {path}")
+        positions = [header.index(c) for c in columns]
+        values = [
+            [row[i] if i < len(row) else None for i in positions]
+            for row in rows
+            if any(value is not None for value in row)
+        ]
+    finally:
+        workbook.close()
+
+    meta = pd.DataFrame(values, columns=columns)
+    # Same types as pd.read_excel: missing values as NaN, numeric columns as numbers
+    return meta.fillna(np.nan).infer_objects()
+
+
+def _save_meta_sidecar(sidecar, meta, stat, file_hash):
+    try:
+        pd.to_pickle(
+            {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "hash": file_hash,
+                "meta": meta,
+            },
+            sidecar + ".tmp",
+        )
+        os.replace(sidecar + ".tmp", sidecar)
+    except OSError:
+        # Snapshot folder is not writable: no cache
+        pass
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from typing import Callable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .generalutils import linearInterp, trapezoid
+from .lookup import select_rows
+
+# Reductions over the year axis of a (row, year) array
+REDUCTIONS = {
+    "trapz": lambda values, years: trapezoid(values, x=years, axis=1),
+    "sum": lambda values, years: values.sum(axis=1),
+    "mean": lambda values, years: values.mean(axis=1),
+    "min": lambda values, years: values.min(axis=1),
+    "max": lambda values, years: values.max(axis=1),
+    "first": lambda values, years: values[:, 0],
+    "last": lambda values, years: values[:, -1],
+}
+
+# Row-wise reduction functions with a vectorized equivalent
+_VECTORIZED = {linearInterp: "trapz"}
+
+
+@dataclass
+class Indicator:
+    """
+    Meta column `name`: the values of `variable` between `year_low` and
+    `year_high`, clipped to [clip_lower, clip_upper] and reduced over the years.
+
+    `reduction` is one of `REDUCTIONS`, or a function that reduces a row
+    (a series with the years as index) to a value.
+    """
+
+    name: str
+    variable: str
+    reduction: Union[str, Callable] = "trapz"
+    year_low: int = 2010
+    year_high: int = 2100
+    clip_lower: Optional[float] = None
+    clip_upper: Optional[float] = None
+    region: Optional[str] = None
+
+
+def calc_indicators(data, indicators):
+    """
+    Computes all `indicators` at once. The rows of each variable are read
+    once as a (scenario, year) array, on which all indicators of that
+    variable are evaluated. Returns a dataframe with one column per
+    indicator, indexed by Name.
+    """
+    years = np.array([c for c in data.columns if isinstance(c, (int, np.integer))])
+    selection = select_rows(data, list({i.variable for i in indicators}))
+    name_codes, names = pd.factorize(selection["Name"])
+    values = selection[list(years)].to_numpy(float)
+    variables = selection["Variable"].to_numpy()
+    regions = selection["Region"].to_numpy()
+
+    result = pd.DataFrame(index=pd.Index(np.asarray(names, dtype=object), name="Name"))
+    for indicator in indicators:
+        rows = variables == indicator.variable
+        if indicator.region is not None:
+            rows &= regions == indicator.region
+        codes = name_codes[rows]
+        if len(np.unique(codes)) != len(codes):
+            raise ValueError(
+                f"Multiple rows per scenario for {indicator.variable}, select a region"
+            )
+        in_window = (years >= indicator.year_low) & (years <= indicator.year_high)
+        window = values[rows][:, in_window]
+        if indicator.clip_lower is not None or indicator.clip_upper is not None:
+            window = np.clip(window, indicator.clip_lower, indicator.clip_upper)
+
+        column = np.full(len(names), np.nan)
+        column[codes] = _reduce(window, years[in_window], indicator.reduction)
+        result[indicator.name] = column
+    return result
+
+
+def add_indicators(scenarios, data, indicators):
+    """Adds the columns of all `indicators` to the `scenarios` dataframe"""
+    values = calc_indicators(data, indicators)
+    for column in values.columns:
+        scenarios[column] = values[column]
+
+
+def _reduce(values, years, reduction):
+    reduction = _VECTORIZED.get(reduction, reduction)
+    if callable(reduction):
+        if len(values) == 0:
+            return np.array([])
+        return pd.DataFrame(values, columns=years).apply(reduction, axis=1).to_numpy()
+    return REDUCTIONS[reduction](values, years.astype(float))
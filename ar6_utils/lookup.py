@@ -0,0 +1,258 @@
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Lookup indices of data and metadata dataframes, by id of the dataframe
+_INDEXES = {}
+_META_INDEXES = {}
+
+
+class DataIndex:
+    """
+    Maps each variable and each (Name, Variable) pair of a data dataframe
+    to the positions of its rows, such that selecting the rows of a variable
+    costs O(rows returned) instead of a scan over the full table.
+
+    The positions are sorted arrays of row positions (for use with `.iloc`).
+    """
+
+    def __init__(self, data):
+        self.n_rows = 0
+        self._name_codes = {}
+        self._variable_codes = {}
+        self._pair_keys = np.array([], dtype=np.int64)
+        self._variable_keys = np.array([], dtype=np.int64)
+        self.extend(data)
+
+    def extend(self, new_rows):
+        """Adds the rows of `new_rows`, which are appended after the current rows"""
+        name_codes = _codes(new_rows["Name"], self._name_codes)
+        variable_codes = _codes(new_rows["Variable"], self._variable_codes)
+        self._pair_keys = np.concatenate(
+            [self._pair_keys, _pair_key(name_codes, variable_codes)]
+        )
+        self._variable_keys = np.concatenate([self._variable_keys, variable_codes])
+        self.n_rows += len(new_rows)
+
+        self._pair_order = np.argsort(self._pair_keys, kind="stable")
+        self._sorted_pair_keys = self._pair_keys[self._pair_order]
+        self._variable_order = np.argsort(self._variable_keys, kind="stable")
+        self._sorted_variable_keys = self._variable_keys[self._variable_order]
+        return self
+
+    def rows(self, variable=None, name=None):
+        """
+        Positions of the rows of `variable` and/or `name`. Both can be
+        a single value or a list of values.
+        """
+        if variable is None and name is None:
+            return np.arange(self.n_rows)
+        variables = (
+            None if variable is None else _lookup(variable, self._variable_codes)
+        )
+        names = None if name is None else _lookup(name, self._name_codes)
+
+        if names is None:
+            positions = [
+                _range(self._sorted_variable_keys, self._variable_order, code, code + 1)
+                for code in variables
+            ]
+        elif variables is None:
+            positions = [
+                _range(
+                    self._sorted_pair_keys,
+                    self._pair_order,
+                    _pair_key(code, -1),
+                    _pair_key(code + 1, -1),
+                )
+                for code in names
+            ]
+        else:
+            positions = [
+                _range(
+                    self._sorted_pair_keys,
+                    self._pair_order,
+                    _pair_key(name_code, variable_code),
+                    _pair_key(name_code, variable_code) + 1,
+                )
+                for name_code in names
+                for variable_code in variables
+            ]
+        if len(positions) == 0:
+            return np.array([], dtype=np.int64)
+        if len(positions) == 1:
+            return positions[0]  # Already sorted (stable argsort)
+        return np.sort(np.concatenate(positions))
+
+
+def _codes(column, mapping):
+    """Integer code of each value in `column`, adding new values to `mapping`"""
+    codes, uniques = pd.factorize(column)
+    lookup_table = np.array(
+        [mapping.setdefault(value, len(mapping)) for value in uniques] + [-1],
+        dtype=np.int64,
+    )
+    return lookup_table[codes]
+
+
+def _lookup(values, mapping):
+    if not isinstance(values, (tuple, list, np.ndarray, pd.Index, pd.Series)):
+        values = [values]
+    return [mapping[value] for value in values if value in mapping]
+
+
+def _pair_key(name_code, variable_code):
+    # Shifted by one, such that missing variables (code -1) sort within their name
+    return np.asarray(name_code, dtype=np.int64) * 2**32 + variable_code + 1
+
+
+def _range(sorted_keys, order, key_low, key_high):
+    start, end = np.searchsorted(sorted_keys, [key_low, key_high])
+    return order[start:end]
+
+
+def get_index(data, rebuild=False):
+    """
+    Returns the lookup index of `data`, building it if it does not exist yet
+    (or if the number of rows changed). After changing the order or the Name
+    or Variable columns of `data` in place (e.g. sorting it in place), use
+    `rebuild=True` to build a new index.
+    """
+    index = _INDEXES.get(id(data))
+    if rebuild or index is None or index.n_rows != len(data):
+        index = DataIndex(data)
+        register_index(data, index)
+    return index
+
+
+def register_index(data, index):
+    _register(_INDEXES, data, index)
+
+
+def _register(indexes, frame, index):
+    if id(frame) not in indexes:
+        weakref.finalize(frame, indexes.pop, id(frame), None)
+    indexes[id(frame)] = index
+
+
+def select_rows(data, variable=None, name=None):
+    """
+    Equivalent to `data[data["Variable"].isin(variable) & data["Name"].isin(name)]`,
+    using the lookup index of `data`
+    """
+    return data.iloc[get_index(data).rows(variable, name)]
+
+
+class MetaIndex:
+    """
+    Index over the columns of a metadata dataframe, such that a combination
+    of meta filters is a set of operations on boolean masks, instead of
+    comparisons on (copies of) the dataframe. Each column is indexed on its
+    first use:
+    - numeric columns as sorted values (ranges and values by binary search)
+    - other columns as a bitmap (boolean mask) per value
+    After editing columns of the metadata in place, use `invalidate` (or
+    `get_meta_index(meta, rebuild=True)`) to index them again.
+    """
+
+    def __init__(self, meta):
+        self.n_rows = len(meta)
+        self._meta = weakref.ref(meta)
+        self._columns = {}
+
+    def mask(self, column, value, values=None):
+        """
+        Mask of the rows where `column` has one of the values `value` (single
+        value, list of values or pd.Interval ranges), or is not missing if
+        `value` is "all". `values` are the values of the column if it is not
+        a column of the dataframe.
+        """
+        index = self._columns.get(column)
+        if index is None:
+            if values is None:
+                values = self._meta()[column]
+            if pd.api.types.is_numeric_dtype(values) and not (
+                pd.api.types.is_bool_dtype(values)
+            ):
+                index = _SortedColumn(values)
+            else:
+                index = _BitmapColumn(values)
+            self._columns[column] = index
+
+        if isinstance(value, str) and value == "all":
+            return ~index.missing
+        if not isinstance(value, (tuple, list, np.ndarray, pd.Series)):
+            value = [value]
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for v in value:
+            if isinstance(v, pd.Interval):
+                mask |= index.between(v.left, v.right)
+            else:
+                mask |= index.equal(v)
+        return mask
+
+    def invalidate(self, *columns):
+        """Drops the index of `columns` (or of all columns), to build it again"""
+        if len(columns) == 0:
+            self._columns.clear()
+        for column in columns:
+            self._columns.pop(column, None)
+
+
+class _SortedColumn:
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        self.missing = np.isnan(values)
+        valid = np.flatnonzero(~self.missing)
+        self._order = valid[np.argsort(values[valid], kind="stable")]
+        self._sorted = values[self._order]
+
+    def between(self, low, high):
+        start = np.searchsorted(self._sorted, low, side="left")
+        end = np.searchsorted(self._sorted, high, side="right")
+        mask = np.zeros(len(self.missing), dtype=bool)
+        mask[self._order[start:end]] = True
+        return mask
+
+    def equal(self, value):
+        if not isinstance(value, (int, float, np.number)):
+            return np.zeros(len(self.missing), dtype=bool)
+        if np.isnan(value):
+            return self.missing.copy()
+        return self.between(value, value)
+
+
+class _BitmapColumn:
+    def __init__(self, values):
+        self._values = pd.Series(np.asarray(values))
+        self._codes, uniques = pd.factorize(self._values)
+        self._code_of = {value: code for code, value in enumerate(uniques)}
+        self._bitmaps = {}
+        self.missing = self._codes == -1
+
+    def between(self, low, high):
+        return self._values.between(low, high).to_numpy()
+
+    def equal(self, value):
+        if pd.api.types.is_scalar(value) and pd.isna(value):
+            return self.missing.copy()
+        code = self._code_of.get(value)
+        if code is None:
+            return np.zeros(len(self._codes), dtype=bool)
+        if code not in self._bitmaps:
+            self._bitmaps[code] = self._codes == code
+        return self._bitmaps[code]
+
+
+def get_meta_index(meta, rebuild=False):
+    """
+    Returns the `MetaIndex` of the metadata dataframe `meta`, creating it if
+    it does not exist yet (or if the number of rows changed). Use
+    `rebuild=True` after editing `meta` in place.
+    """
+    index = _META_INDEXES.get(id(meta))
+    if rebuild or index is None or index.n_rows != len(meta):
+        index = MetaIndex(meta)
+        _register(_META_INDEXES, meta, index)
+    return index
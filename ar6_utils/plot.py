@@ -6,6 +6,8 @@ import pandas as pd
 import numpy as np
 import importlib.resources as pkg_resources
 
+from .stats import group_codes, grouped_quantiles
+
 PLOTLY_WIDTH_PX = 1050
 PAGE_WIDTH_MM = 170.65
 
@@ -119,16 +121,7 @@ def line_continuous_error_bars(
     output_dict_prefix="",
     **kwargs,
 ):
-    grouped_df = df.groupby(groupby_columns)[value_col]
-
-    quantiles = (
-        grouped_df.quantile([q_low, 0.5, q_high])
-        .unstack(level=-1)
-        .rename_axis(columns="Quantile")
-        .stack()
-        .to_frame(value_col)
-        .reset_index()
-    )
+    quantiles = _group_quantiles(df, groupby_columns, value_col, [q_low, 0.5, q_high])
 
     _fig1 = px.line(
         quantiles[quantiles["Quantile"].isin([q_low, q_high])],
@@ -157,6 +150,22 @@ def line_continuous_error_bars(
     )
 
 
+def _group_quantiles(df, groupby_columns, value_col, levels):
+    # Same as df.groupby(groupby_columns)[value_col].quantile(levels) in long
+    # format (without empty groups), with one row per group and quantile
+    if not isinstance(groupby_columns, (tuple, list)):
+        groupby_columns = [groupby_columns]
+    codes, groups = group_codes(df[list(groupby_columns)].reset_index(drop=True))
+    valid = codes != -1
+    values, _ = grouped_quantiles(
+        df[value_col].to_numpy(float)[valid], codes[valid], len(groups), levels
+    )
+    quantiles = groups.loc[groups.index.repeat(len(levels))].reset_index(drop=True)
+    quantiles["Quantile"] = np.tile(levels, len(groups))
+    quantiles[value_col] = values[:, :, 0].T.ravel()
+    return quantiles.dropna(subset=[value_col]).reset_index(drop=True)
+
+
 def add_funnel(
     fig: go.Figure,
     df: pd.DataFrame,
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+DEFAULT_QUANTILES = [0.05, 0.5, 0.95]
+
+
+def grouped_quantiles(values, codes, n_groups, quantiles):
+    """
+    Quantiles of the rows of `values` (row, year) per group, where `codes`
+    is the group of each row. Missing values are ignored and the quantiles
+    are linearly interpolated (as in pandas). All groups, years and quantile
+    levels are computed at once, from the sorted values of each group.
+
+    Returns the quantiles (quantile, group, year) and the number of values
+    of each group (group, year).
+    """
+    grouped = _group_values(values, codes, n_groups)
+    counts = (~np.isnan(grouped)).sum(axis=1)
+    return _quantiles(grouped, counts, quantiles), counts
+
+
+def _group_values(values, codes, n_groups):
+    # Sorted values of each group in its own slice: (group, row in group, year)
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    codes = np.asarray(codes)
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    sizes = np.bincount(sorted_codes, minlength=n_groups)
+    starts = np.cumsum(sizes) - sizes
+    rows = np.arange(len(codes)) - starts[sorted_codes]
+    grouped = np.full((n_groups, sizes.max(initial=0), values.shape[1]), np.nan)
+    grouped[sorted_codes, rows] = values[order]
+    grouped.sort(axis=1)  # Missing values last
+    return grouped
+
+
+def _quantiles(grouped, counts, quantiles):
+    position = np.asarray(quantiles, dtype=float)[:, None, None] * (counts - 1)
+    low = np.floor(position)
+    fraction = position - low
+    low = low.astype(int).clip(0)
+    high = np.minimum(low + 1, counts - 1).clip(0)
+    values_low = _take_rows(grouped, low)
+    values_high = _take_rows(grouped, high)
+    with np.errstate(invalid="ignore"):
+        result = values_low + fraction * (values_high - values_low)
+    result[:, counts == 0] = np.nan
+    return result
+
+
+def _take_rows(grouped, rows):
+    # grouped[g, rows[q, g, y], y] for each (q, g, y)
+    rows = rows.transpose(1, 0, 2)
+    return np.take_along_axis(grouped, rows, axis=1).transpose(1, 0, 2)
+
+
+def group_codes(groups):
+    """
+    Group of each row of the dataframe `groups` (one column per group column)
+    and the dataframe of the groups, in sorted order. Rows with a missing
+    group value get code -1 (as they are left out by groupby).
+    """
+    codes = np.full(len(groups), -1)
+    valid = groups.notna().all(axis=1).to_numpy()
+    if not valid.any():
+        return codes, groups.iloc[:0].reset_index(drop=True)
+    valid_codes, uniques = pd.MultiIndex.from_frame(groups[valid]).factorize(sort=True)
+    codes[valid] = valid_codes
+    return codes, uniques.to_frame(index=False, name=list(groups.columns))
+
+
+def group_stats(values, groups, quantiles=None, mean=True, count=True):
+    """
+    Quantiles, mean and count of `values` (a dataframe with a column per year)
+    per group and per year. `groups` has one column per group column, with the
+    group of each row of `values`.
+
+    Returns a dataframe with index (group columns, Year) and a column per
+    quantile level (and "mean" and "count"). The result of one group can be
+    used directly in `plot.add_funnel`.
+    """
+    if quantiles is None:
+        quantiles = DEFAULT_QUANTILES
+    codes, uniques = group_codes(groups.reset_index(drop=True))
+    valid = codes != -1
+    grouped = _group_values(values.to_numpy(float)[valid], codes[valid], len(uniques))
+    counts = (~np.isnan(grouped)).sum(axis=1)
+
+    stats = dict(zip(quantiles, _quantiles(grouped, counts, quantiles)))
+    if mean:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["mean"] = np.nansum(grouped, axis=1) / counts
+    if count:
+        stats["count"] = counts
+
+    # Row for each (group, year)
+    years = pd.Index(values.columns)
+    n_years = len(years)
+    index = pd.MultiIndex.from_arrays(
+        [uniques[column].to_numpy().repeat(n_years) for column in uniques.columns]
+        + [years.take(np.tile(np.arange(n_years), len(uniques)))],
+        names=list(uniques.columns) + ["Year"],
+    )
+    return pd.DataFrame(
+        {key: value.ravel() for key, value in stats.items()}, index=index
+    )
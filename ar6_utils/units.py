@@ -0,0 +1,43 @@
+import numpy as np
+
+from .data import replace_values
+
+# Source unit: (target unit, factor)
+UNIT_CONVERSIONS = {
+    "Mt CO2/yr": ("Gt CO2/yr", 0.001),
+    # "Mt CH4/yr": ("Gt CH4/yr", 0.001),
+    "kt N2O/yr": ("Mt N2O/yr", 0.001),
+    "Mt CO2-equiv/yr": ("Gt CO2-equiv/yr", 0.001),
+}
+
+
+def register_unit_conversion(source, target, factor):
+    """
+    Adds a conversion to `UNIT_CONVERSIONS`: values in unit `source` are
+    multiplied by `factor` and get unit `target`
+    """
+    UNIT_CONVERSIONS[source] = (target, factor)
+
+
+def convert_units(data, conversions=None):
+    """
+    Converts the units of `data` in place, in one pass over the year columns.
+    By default, the conversions of `UNIT_CONVERSIONS` are used.
+    """
+    if conversions is None:
+        conversions = UNIT_CONVERSIONS
+    years = [c for c in data.columns if isinstance(c, (int, np.integer))]
+
+    # Factor per unit (category), then per row
+    units = data["Unit"].astype("category")
+    factors = np.array(
+        [conversions.get(unit, (unit, 1.0))[1] for unit in units.cat.categories]
+        + [1.0]  # Rows without unit (code -1)
+    )
+    row_factors = factors[units.cat.codes.to_numpy()]
+    if (row_factors != 1.0).any():
+        data[years] = data[years].to_numpy(float) * row_factors[:, None]
+
+    data["Unit"] = replace_values(
+        units, {source: target for source, (target, _) in conversions.items()}
+    )